@@ -0,0 +1,103 @@
+""" GET latency through the authorization layer: BaseHTTPMiddleware vs pure ASGI
+
+Run from the erudite directory: python -m benchmarks.auth_middleware
+"""
+
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("PSQL_DB_URL", "postgresql://localhost/benchmark")
+os.environ.setdefault("MONGO_DB_URL", "mongodb://localhost")
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+
+from fastapi import FastAPI, Request
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from core.middleware import AuthorizationMiddleware
+
+
+REQUESTS = 5000
+
+
+async def authorization(request: Request, call_next):
+    """ Dispatch function that was used with BaseHTTPMiddleware """
+
+    if request.method == "GET":
+        return await call_next(request)
+
+
+def create_app(middleware: str) -> FastAPI:
+    app = FastAPI()
+
+    if middleware == "BaseHTTPMiddleware":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=authorization)
+    elif middleware == "AuthorizationMiddleware":
+        app.add_middleware(AuthorizationMiddleware)
+
+    @app.get("/rooms")
+    async def list_rooms():
+        return [{"id": str(i), "ruz_number": str(i)} for i in range(20)]
+
+    return app
+
+
+async def get(app: FastAPI):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/rooms",
+        "raw_path": b"/rooms",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 40000),
+        "server": ("localhost", 6000),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+
+        # The client never disconnects, wait to be cancelled like a real server would
+        await asyncio.Event().wait()
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure(middleware: str) -> list:
+    app = create_app(middleware)
+    for _ in range(REQUESTS // 10):  # warm up
+        await get(app)
+
+    timings = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await get(app)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+async def main():
+    for middleware in ["none", "BaseHTTPMiddleware", "AuthorizationMiddleware"]:
+        timings = sorted(await measure(middleware))
+        print(
+            f"{middleware:<24} "
+            f"mean {statistics.mean(timings) * 1e6:8.1f} us   "
+            f"p50 {timings[len(timings) // 2] * 1e6:8.1f} us   "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:8.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+""" Decoding documents into the API shape: mongo_to_dict copies vs the Document codec
+
+Run from the erudite directory: python -m benchmarks.documents
+"""
+
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+os.environ.setdefault("PSQL_DB_URL", "postgresql://localhost/benchmark")
+os.environ.setdefault("MONGO_DB_URL", "mongodb://localhost")
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from bson.objectid import ObjectId
+
+from core.database.utils import CODEC_OPTIONS, mongo_to_dict
+
+
+DOCUMENTS = 100_000
+ROUNDS = 5
+
+
+def make_batch() -> bytes:
+    """ Documents as they come from the server: concatenated BSON """
+
+    start = datetime(2021, 9, 1, 9, 30)
+    return b"".join(
+        bson.encode(
+            {
+                "_id": ObjectId(),
+                "room_name": "504",
+                "date": (start + timedelta(hours=i)).strftime("%Y-%m-%d"),
+                "start_time": "09:30",
+                "end_time": "10:50",
+                "type": "Autorecord",
+                "url": f"https://drive.google.com/file/d/{i}",
+                "keywords": ["сети", "протокол", "маршрутизация"],
+                "start": start + timedelta(hours=i),
+                "end": start + timedelta(hours=i, minutes=80),
+            }
+        )
+        for i in range(DOCUMENTS)
+    )
+
+
+def copied(data: bytes) -> list:
+    return [mongo_to_dict(document) for document in bson.decode_all(data, DEFAULT_CODEC_OPTIONS)]
+
+
+def decoded(data: bytes) -> list:
+    return bson.decode_all(data, CODEC_OPTIONS)
+
+
+def measure(decode, data: bytes):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        decode(data)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    documents = decode(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert "id" in documents[0] and "_id" not in documents[0]
+    return min(timings), peak
+
+
+def main():
+    data = make_batch()
+
+    for name, decode in [("mongo_to_dict", copied), ("Document codec", decoded)]:
+        best, peak = measure(decode, data)
+        print(f"{name:<16} best {best * 1e3:7.1f} ms   peak {peak / 2 ** 20:7.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+""" GET /lessons serialization: response_model validation vs trusted orjson responses
+
+Run from the erudite directory: python -m benchmarks.responses
+"""
+
+import asyncio
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+os.environ.setdefault("PSQL_DB_URL", "postgresql://localhost/benchmark")
+os.environ.setdefault("MONGO_DB_URL", "mongodb://localhost")
+os.environ.setdefault("MONGO_DB_NAME", "benchmark")
+
+from bson.objectid import ObjectId
+from fastapi import FastAPI, Response
+
+from core.database.lessons import Lesson
+from core.routes import utils
+from core.routes.utils import trusted
+
+
+LESSONS = 5000
+REQUESTS = 20
+
+
+def make_lessons() -> list:
+    start = datetime(2021, 9, 1, 9, 30)
+    return [
+        {
+            "id": str(ObjectId()),
+            "ruz_auditorium": "510",
+            "ruz_auditorium_oid": 3308,
+            "ruz_building": "Таллинская ул., д, 34",
+            "ruz_building_oid": 92,
+            "ruz_discipline": "Компьютерные сети",
+            "ruz_discipline_oid": 1000 + i,
+            "ruz_kind_of_work": "Лекция",
+            "ruz_kind_of_work_oid": 1,
+            "ruz_lecturer_title": "Иванов И.И.",
+            "ruz_lecturer_email": "iivanov@hse.ru",
+            "ruz_lesson_oid": i,
+            "ruz_url": "https://ruz.hse.ru",
+            "course_code": "2.1.1",
+            "date": (start + timedelta(hours=i)).strftime("%Y-%m-%d"),
+            "start_time": "09:30",
+            "end_time": "10:50",
+            "start": start + timedelta(hours=i),
+            "end": start + timedelta(hours=i, minutes=80),
+        }
+        for i in range(LESSONS)
+    ]
+
+
+def create_app(lessons: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/lessons", response_model=List[Lesson])
+    async def get_lessons(response: Response):
+        return trusted(lessons, response)
+
+    return app
+
+
+async def get(app: FastAPI) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/lessons",
+        "raw_path": b"/lessons",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 40000),
+        "server": ("localhost", 6000),
+    }
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    size = 0
+
+    async def receive():
+        if messages:
+            return messages.pop()
+
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal size
+        size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return size
+
+
+async def measure(app: FastAPI) -> list:
+    await get(app)  # warm up
+
+    timings = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await get(app)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+async def main():
+    app = create_app(make_lessons())
+
+    for mode in [False, True]:
+        utils.settings.trusted_responses = mode
+        size = await get(app)
+        timings = sorted(await measure(app))
+        print(
+            f"trusted_responses={mode!s:<5}  "
+            f"mean {statistics.mean(timings) * 1e3:7.1f} ms   "
+            f"p50 {timings[len(timings) // 2] * 1e3:7.1f} ms   "
+            f"body {size / 1024:7.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+""" In-process caches """
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+_missing = object()
+
+
+class TTLCache:
+    """ LRU cache whose entries expire `ttl` seconds after they were set """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        # Bumped on invalidation, so values read before it are not stored after it
+        self.generation = 0
+
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _missing)
+        if item is not _missing:
+            value, expires_at = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+        self.generation += 1
+
+    def clear(self):
+        self._data.clear()
+        self.generation += 1
+
+
+def _hashable(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+
+    return value
+
+
+def cached(cache: TTLCache) -> Callable:
+    """ Cache results of a coroutine function by its name and arguments.
+    None is not cached, so missing documents are looked up again """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args):
+            key = (func.__name__, *map(_hashable, args))
+
+            result = cache.get(key)
+            if result is None:
+                generation = cache.generation
+                result = await func(*args)
+                if result is not None and cache.generation == generation:
+                    cache.set(key, result)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class SingleFlight:
+    """ Calls in flight, shared by concurrent callers with the same arguments """
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.calls)
+
+    def clear(self):
+        """ Callers that come after a write start a new call instead of joining
+        one that may have read the collection before the write """
+
+        self.calls.clear()
+
+
+def single_flight(flights: SingleFlight) -> Callable:
+    """ Run a coroutine function once for concurrent calls with the same name and
+    arguments, every caller awaits the same call and gets the same result.
+    A caller that is cancelled does not cancel the call for the others """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (
+                func.__name__,
+                *map(_hashable, args),
+                *sorted((name, _hashable(value)) for name, value in kwargs.items()),
+            )
+
+            future = flights.calls.get(key)
+            if future is None:
+                flights.misses += 1
+                future = asyncio.ensure_future(func(*args, **kwargs))
+                flights.calls[key] = future
+
+                def forget(future: asyncio.Future):
+                    if flights.calls.get(key) is future:
+                        del flights.calls[key]
+
+                future.add_done_callback(forget)
+            else:
+                flights.hits += 1
+
+            return await asyncio.shield(future)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,193 @@
+""" Mongo change streams
+
+One change stream per worker watches the collections that have listeners
+and passes every change event to them. Subscriptions of the change feed
+are fanned out from it too. A client resuming after a token is replayed
+from a change stream of its own only until it gets to the events of the
+shared one. Enabled with the CHANGE_STREAMS setting, as change streams
+need a replica set.
+"""
+
+import asyncio
+from collections import defaultdict, deque
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+from pymongo.errors import ConnectionFailure
+
+from .models import db
+from ..settings import settings
+
+
+listeners: Dict[str, List[Callable[[Optional[dict]], None]]] = defaultdict(list)
+
+watcher: Optional[asyncio.Task] = None
+
+# Collections of the change feed and the fields with the room name of their documents
+FEED_COLLECTIONS = {
+    "lessons": "ruz_auditorium",
+    "records": "room_name",
+    "rooms": "ruz_number",
+    "equipment": "room_name",
+}
+
+
+def add_listener(collection: str, listener: Callable[[Optional[dict]], None]):
+    """ Call listener with every change event of the collection, and with None
+    when the stream starts over and changes may have been missed """
+
+    listeners[collection].append(listener)
+
+
+def notify(collection: str, change: Optional[dict]):
+    for listener in listeners[collection]:
+        try:
+            listener(change)
+        except Exception:
+            logger.exception(f"Listener of {collection} changes failed")
+
+
+async def watch():
+    pipeline = [{"$match": {"ns.coll": {"$in": list(listeners)}}}]
+    resume_token = None
+
+    while True:
+        try:
+            async with db.watch(
+                pipeline, full_document="updateLookup", resume_after=resume_token
+            ) as stream:
+                if resume_token is None:
+                    # Nothing tells what changed before the stream started
+                    for collection in list(listeners):
+                        notify(collection, None)
+
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    notify(change["ns"]["coll"], change)
+        except ConnectionFailure as e:
+            logger.warning(f"Change stream is interrupted: {e}")
+            await asyncio.sleep(1)
+        except Exception as e:
+            # E.g. the resume token is no longer in the oplog, resuming would fail forever
+            logger.error(f"Change stream is lost, it starts over and caches are dropped: {e}")
+            resume_token = None
+            await asyncio.sleep(1)
+
+
+async def start():
+    global watcher
+    watcher = asyncio.create_task(watch())
+
+
+async def stop():
+    if watcher is not None:
+        watcher.cancel()
+
+
+def matches(change: dict, collections: Set[str], room: Optional[str]) -> bool:
+    """ Check if the change of a document is asked for. Deleted documents are
+    gone, so their deletes are sent whatever room was asked for """
+
+    collection = change["ns"]["coll"]
+    if collection not in collections or "documentKey" not in change:
+        return False
+
+    document = change.get("fullDocument")
+    if room is None or document is None:
+        return True
+
+    return document.get(FEED_COLLECTIONS[collection]) == room
+
+
+class Subscription:
+    """ Change events for one client of the feed """
+
+    def __init__(self, collections: Iterable[str], room: Optional[str] = None):
+        self.collections = set(collections)
+        self.room = room
+        self.queue = asyncio.Queue(maxsize=settings.changes_queue_size)
+
+        # Set when the client falls behind, it has to resume with a stream of its own
+        self.overflowed = False
+        # Resume token of the first queued event
+        self.first: Optional[str] = None
+
+    def put(self, change: dict):
+        if not matches(change, self.collections, self.room):
+            return
+
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return
+
+        if self.first is None:
+            self.first = change["_id"]["_data"]
+
+
+subscriptions: Set[Subscription] = set()
+
+
+def fan_out(change: Optional[dict]):
+    for subscription in subscriptions:
+        if change is None:
+            # Changes may have been missed, clients resume after the ones they got
+            subscription.overflowed = True
+        else:
+            subscription.put(change)
+
+
+for collection in FEED_COLLECTIONS:
+    add_listener(collection, fan_out)
+
+
+async def feed(
+    collections: Iterable[str], room: Optional[str] = None, resume_after: Optional[dict] = None
+) -> AsyncIterator[Optional[dict]]:
+    """ Change events of the collections from the shared change stream. To resume
+    after a token, events are replayed from a change stream of its own until it
+    gets to the first event of the shared one, or has no more events. Yields None
+    when there were no events for `changes_keepalive` seconds """
+
+    collections = set(collections)
+
+    subscription = Subscription(collections, room)
+    subscriptions.add(subscription)
+    try:
+        # Tokens of the replayed events, the shared stream may be behind and queue them too.
+        # More of them would not fit in the queue
+        sent = deque(maxlen=settings.changes_queue_size)
+
+        if resume_after is not None:
+            pipeline = [{"$match": {"ns.coll": {"$in": list(collections)}}}]
+            async with db.watch(
+                pipeline,
+                full_document="updateLookup",
+                resume_after=resume_after,
+                max_await_time_ms=settings.changes_keepalive * 1000,
+            ) as stream:
+                while stream.alive and subscription.first not in sent:
+                    change = await stream.try_next()
+                    if change is None or change["_id"]["_data"] == subscription.first:
+                        break
+                    if matches(change, collections, room):
+                        sent.append(change["_id"]["_data"])
+                        yield change
+
+        # Events queued before the overflow are sent, the client resumes after them
+        while not (subscription.overflowed and subscription.queue.empty()):
+            try:
+                change = await asyncio.wait_for(
+                    subscription.queue.get(), timeout=settings.changes_keepalive
+                )
+            except asyncio.TimeoutError:
+                yield None
+                continue
+
+            if change["_id"]["_data"] in sent:
+                continue
+            sent.clear()
+            yield change
+    finally:
+        subscriptions.discard(subscription)
@@ -1,11 +1,16 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
+from pymongo import ReturnDocument
 
 from ..database.models import db
-from ..database.utils import mongo_to_dict
+from ..database import revisions, versions
+from ..database.utils import CODEC_OPTIONS, mongo_to_dict
+from ..cache import SingleFlight, single_flight
 
 
-disciplines_collection = db.get_collection("disciplines")
+disciplines_collection = db.get_collection("disciplines", codec_options=CODEC_OPTIONS)
+disciplines_flights = SingleFlight()
+versions.add_listener("disciplines", disciplines_flights.clear)
 
 
 # Class of disciplines
@@ -21,60 +26,52 @@ class Discipline(BaseModel):
         extra = "allow"
 
 
-async def get_all() -> list:
+@single_flight(disciplines_flights)
+async def get_all(projection: Optional[dict] = None) -> list:
     """ Get all disciplines from db """
 
-    return [
-        mongo_to_dict(discipline) async for discipline in disciplines_collection.find()
-    ]
+    return await disciplines_collection.find({}, projection).to_list(None)
 
 
+@single_flight(disciplines_flights)
 async def get(discipline_id: str) -> Discipline:
     """ Get discipline by its db id """
 
-    discipline = await disciplines_collection.find_one({"_id": discipline_id})
-    if discipline:
-        return mongo_to_dict(discipline)
+    return await disciplines_collection.find_one({"_id": discipline_id})
 
 
-async def get_by_cource_code(course_code: str) -> dict:
+@single_flight(disciplines_flights)
+async def get_by_cource_code(course_code: str, projection: Optional[dict] = None) -> dict:
     """ Get discipline by its course_code """
 
-    discipline = await disciplines_collection.find_one({"course_code": course_code})
-    if discipline:
-        return mongo_to_dict(discipline)
+    return await disciplines_collection.find_one({"course_code": course_code}, projection)
 
 
 async def add(discipline: dict) -> dict:
     """ Add discipline to db """
 
-    discipline_added = await disciplines_collection.insert_one(discipline)
-    new = await disciplines_collection.find_one({"_id": discipline_added.inserted_id})
-    return mongo_to_dict(new)
-
-
-async def add_empty(discipline_id: str):
-    """ Add empty discipline with specified id to db """
-
-    await disciplines_collection.insert_one({"_id": discipline_id})
+    discipline["revision"] = revisions.next_revision()
+    await disciplines_collection.insert_one(discipline)  # sets discipline["_id"]
+    versions.bump("disciplines")
+    return mongo_to_dict(discipline)
 
 
 async def remove(discipline_id: str):
     """ Delete discipline from db """
 
-    await disciplines_collection.delete_one({"_id": discipline_id})
+    revision = revisions.next_revision()
+    result = await disciplines_collection.delete_one({"_id": discipline_id})
+    if result.deleted_count:
+        await revisions.add_tombstone("disciplines", discipline_id, revision)
+    versions.bump("disciplines")
 
 
-async def patch_all(discipline_id: str, new_values: Discipline):
-    """ Patch discipline """
+async def put(discipline_id: str, new_values: dict) -> Optional[dict]:
+    """ Replace discipline with new values, returns None if there is no such discipline """
 
-    await disciplines_collection.update_one(
-        {"_id": discipline_id},
-        {
-            "$set": {
-                "course_code": new_values.course_code,
-                "groups": new_values.groups,
-                "emails": new_values.emails,
-            }
-        },
+    new_values["revision"] = revisions.next_revision()
+    discipline = await disciplines_collection.find_one_and_replace(
+        {"_id": discipline_id}, new_values, return_document=ReturnDocument.AFTER
     )
+    versions.bump("disciplines")
+    return discipline
@@ -1,11 +1,21 @@
 from pydantic import BaseModel, Field
 from typing import Dict, Optional, List, Union
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 
 from ..database.models import db
-from ..database.utils import mongo_to_dict
+from ..database import revisions, versions
+from ..settings import settings
+from ..database.utils import CODEC_OPTIONS, find_by_ids, mongo_to_dict
+from ..cache import SingleFlight, TTLCache, cached, single_flight
 
 
-equipment_collection = db.get_collection("equipment")
+equipment_collection = db.get_collection("equipment", codec_options=CODEC_OPTIONS)
+
+equipment_cache = TTLCache(maxsize=settings.catalog_cache_size, ttl=settings.catalog_cache_ttl)
+versions.add_listener("equipment", equipment_cache.clear)
+equipment_flights = SingleFlight()
+versions.add_listener("equipment", equipment_flights.clear)
 
 
 class Equipment(BaseModel):
@@ -38,70 +48,88 @@ class Equipment(BaseModel):
         extra = "allow"
 
 
-async def get_all() -> List[Dict[str, Union[str, int]]]:
+@cached(equipment_cache)
+@single_flight(equipment_flights)
+async def get_all(projection: Optional[dict] = None) -> List[Dict[str, Union[str, int]]]:
     """ Get all equipment from db """
 
-    return [mongo_to_dict(equipment) async for equipment in equipment_collection.find()]
+    return await equipment_collection.find({}, projection).to_list(None)
 
 
+@cached(equipment_cache)
+@single_flight(equipment_flights)
 async def get(equipment_id: str) -> Optional[Dict[str, Union[str, int]]]:
     """ Get equipment by its db id """
 
-    equipment = await equipment_collection.find_one({"_id": equipment_id})
-    if equipment:
-        return mongo_to_dict(equipment)
+    return await equipment_collection.find_one({"_id": equipment_id})
+
+
+# Not cached, the cache would fill up with one entry per set of ids
+@single_flight(equipment_flights)
+async def get_many(ids: List[ObjectId], projection: Optional[dict] = None) -> list:
+    """ Get equipment by their db ids, in the order of ids """
+
+    return await find_by_ids(equipment_collection, ids, projection)
 
 
 async def get_by_name(name: str) -> Optional[Dict[str, Union[str, int]]]:
     """ Get equipment by its name """
 
-    equipment = await equipment_collection.find_one({"name": name})
-    if equipment:
-        return mongo_to_dict(equipment)
+    return await equipment_collection.find_one({"name": name})
 
 
 async def add(equipment: dict) -> Optional[Dict[str, Union[str, int]]]:
     """ Add equipment to db """
 
-    equipment_added = await equipment_collection.insert_one(equipment)
-    new = await equipment_collection.find_one({"_id": equipment_added.inserted_id})
-    return mongo_to_dict(new)
-
-
-async def add_empty(equipment_id: str):
-    """ Add empty equipment with specified id to db """
-
-    await equipment_collection.insert_one({"_id": equipment_id})
+    equipment["revision"] = revisions.next_revision()
+    await equipment_collection.insert_one(equipment)  # sets equipment["_id"]
+    versions.bump("equipment")
+    return mongo_to_dict(equipment)
 
 
 async def remove(equipment_id: str):
     """ Delete equipment from db """
 
-    await equipment_collection.delete_one({"_id": equipment_id})
+    revision = revisions.next_revision()
+    result = await equipment_collection.delete_one({"_id": equipment_id})
+    if result.deleted_count:
+        await revisions.add_tombstone("equipment", equipment_id, revision)
+    versions.bump("equipment")
 
 
 async def patch(equipment_id: str, new_values: dict):
     """ Patch equipment """
 
+    new_values["revision"] = revisions.next_revision()
     await equipment_collection.update_one(
         {"_id": equipment_id},
         {"$set": new_values},
     )
+    versions.bump("equipment")
+
+
+async def put(equipment_id: str, new_values: dict) -> Optional[Dict[str, Union[str, int]]]:
+    """ Replace equipment with new values, returns None if there is no such equipment """
+
+    new_values["revision"] = revisions.next_revision()
+    equipment = await equipment_collection.find_one_and_replace(
+        {"_id": equipment_id}, new_values, return_document=ReturnDocument.AFTER
+    )
+    versions.bump("equipment")
+    return equipment
 
 
-async def sort(room_id: str) -> list:
+@cached(equipment_cache)
+@single_flight(equipment_flights)
+async def sort(room_id: str, projection: Optional[dict] = None) -> list:
     """ Get equipment by its db room_id """
 
-    return [
-        mongo_to_dict(equipment)
-        async for equipment in equipment_collection.find({"room_id": str(room_id)})
-    ]
+    return await equipment_collection.find({"room_id": str(room_id)}, projection).to_list(None)
 
 
-async def sort_many(attributes: dict) -> list:
+@cached(equipment_cache)
+@single_flight(equipment_flights)
+async def sort_many(attributes: dict, projection: Optional[dict] = None) -> list:
     """ Get equipment by its db attributes """
 
-    return [
-        mongo_to_dict(equipment)
-        async for equipment in equipment_collection.find(attributes)
-    ]
+    return await equipment_collection.find(attributes, projection).to_list(None)
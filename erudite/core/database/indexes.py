@@ -0,0 +1,203 @@
+""" Indexes of the collections
+
+They are ensured on startup. To see which of the module queries would
+still scan a whole collection, and which values keep unique indexes from
+being built, run from the erudite directory:
+
+    python -m core.database.indexes
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Iterator
+
+from loguru import logger
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+
+from .models import db
+
+
+# collection: [(keys, options)]
+INDEXES = {
+    "rooms": [
+        ([("ruz_auditorium_oid", ASCENDING)], {"unique": True}),
+        ([("revision", ASCENDING)], {}),
+    ],
+    "equipment": [
+        # Also serves the $lookup of rooms with their equipment
+        ([("room_id", ASCENDING)], {}),
+        ([("name", ASCENDING)], {"unique": True}),
+        ([("revision", ASCENDING)], {}),
+    ],
+    "disciplines": [
+        ([("course_code", ASCENDING)], {"unique": True}),
+        ([("revision", ASCENDING)], {}),
+    ],
+    "lessons": [
+        ([("ruz_lesson_oid", ASCENDING)], {"unique": True}),
+        ([("ruz_auditorium", ASCENDING), ("start", ASCENDING)], {}),
+        # Schedule of a room at a time before the in-memory one
+        ([("ruz_auditorium_oid", ASCENDING), ("start", ASCENDING)], {}),
+        ([("start", ASCENDING)], {}),
+        ([("revision", ASCENDING)], {}),
+    ],
+    "records": [
+        # Empty and missing urls are allowed to repeat
+        ([("url", ASCENDING)], {"unique": True, "partialFilterExpression": {"url": {"$gt": ""}}}),
+        ([("date", DESCENDING), ("_id", DESCENDING)], {}),
+        # Overlap queries bound start from both sides, by at most a day more than
+        # the interval, and filter end inside the index
+        ([("room_name", ASCENDING), ("start", ASCENDING), ("end", ASCENDING)], {}),
+        ([("start", ASCENDING), ("end", ASCENDING)], {}),
+        # Keywords come from russian speech, words are matched by their stems
+        ([("keywords", TEXT)], {"default_language": "russian"}),
+        ([("revision", ASCENDING)], {}),
+    ],
+    "tombstones": [
+        ([("collection", ASCENDING), ("revision", ASCENDING)], {}),
+    ],
+}
+
+# Queries issued by the database modules: (collection, filter, sort)
+QUERIES = [
+    ("rooms", {"ruz_auditorium_oid": 0}, None),
+    ("equipment", {"room_id": ""}, None),
+    ("equipment", {"name": ""}, None),
+    ("disciplines", {"course_code": ""}, None),
+    ("lessons", {"ruz_lesson_oid": 0}, None),
+    (
+        "lessons",
+        {
+            "ruz_auditorium": "",
+            "start": {"$gte": datetime.min, "$lt": datetime.max},
+            "end": {"$lte": datetime.max},
+        },
+        None,
+    ),
+    ("lessons", {"start": {"$gte": datetime.min, "$lt": datetime.max}}, None),
+    (
+        "lessons",
+        {"ruz_auditorium_oid": 0, "start": {"$lte": datetime.max}, "end": {"$gt": datetime.min}},
+        [("start", DESCENDING)],
+    ),
+    ("lessons", {"ruz_auditorium_oid": 0, "start": {"$gt": datetime.min}}, [("start", ASCENDING)]),
+    ("records", {"url": "x"}, None),
+    ("records", {}, [("date", DESCENDING), ("_id", DESCENDING)]),
+    (
+        "records",
+        {
+            "room_name": "",
+            "camera_ip": "",
+            "start": {"$gt": datetime.min, "$lt": datetime.max},
+            "end": {"$gt": datetime.min},
+        },
+        None,
+    ),
+    (
+        "records",
+        {"start": {"$gt": datetime.min, "$lt": datetime.max}, "end": {"$gt": datetime.min}},
+        [("_id", ASCENDING)],
+    ),
+    ("records", {"_id": {"$gt": ObjectId()}}, [("_id", ASCENDING)]),
+    ("records", {"$text": {"$search": "x"}, "room_name": ""}, None),
+    ("rooms", {"revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("equipment", {"revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("disciplines", {"revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("lessons", {"revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("records", {"revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+    ("tombstones", {"collection": "", "revision": {"$gt": 0}}, [("revision", ASCENDING)]),
+]
+
+
+async def ensure_indexes():
+    """ Create missing indexes, existing ones are left as they are. Creates
+    are checked against unique indexes only, so the app does not start
+    without them """
+
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                if options.get("unique"):
+                    # E.g. the field already has duplicates, they have to be removed first
+                    logger.error(
+                        f"Unique index {keys} on {collection} was not created: {e}. "
+                        "Duplicates are listed by `python -m core.database.indexes`"
+                    )
+                    raise
+                logger.warning(f"Index {keys} on {collection} was not created: {e}")
+
+
+def _stages(plan) -> Iterator[str]:
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _stages(value)
+
+
+async def find_collection_scans() -> list:
+    """ Explain every known query and return those planned as a COLLSCAN """
+
+    scans = []
+    for collection, query, sort in QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        explanation = await cursor.explain()
+        if "COLLSCAN" in _stages(explanation["queryPlanner"]["winningPlan"]):
+            scans.append((collection, query, sort))
+
+    return scans
+
+
+async def find_duplicates() -> list:
+    """ Find values that repeat in the keys of unique indexes, with the ids of
+    their documents """
+
+    duplicates = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            if not options.get("unique"):
+                continue
+
+            pipeline = [
+                {"$match": options.get("partialFilterExpression", {})},
+                {
+                    "$group": {
+                        "_id": {key: f"${key}" for key, _ in keys},
+                        "ids": {"$push": "$_id"},
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$match": {"count": {"$gt": 1}}},
+            ]
+            async for group in db[collection].aggregate(pipeline, allowDiskUse=True):
+                duplicates.append((collection, group["_id"], group["ids"]))
+
+    return duplicates
+
+
+async def main():
+    duplicates = await find_duplicates()
+    for collection, key, ids in duplicates:
+        print(f"DUPLICATE  {collection}  {key}  {[str(_id) for _id in ids]}")
+
+    print(f"{len(duplicates)} values repeat in unique indexes")
+
+    scans = await find_collection_scans()
+    for collection, query, sort in scans:
+        print(f"COLLSCAN  {collection}  find({query})" + (f".sort({sort})" if sort else ""))
+
+    print(f"{len(scans)} of {len(QUERIES)} queries scan a whole collection")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
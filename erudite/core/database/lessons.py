@@ -1,12 +1,43 @@
 from loguru import logger
-from typing import Dict, Optional, List, Union
+from typing import Callable, Dict, Optional, List, Union
+from datetime import datetime
 from pydantic import BaseModel, Field
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 
 from .models import db
-from .utils import mongo_to_dict
+from . import revisions, versions
+from .utils import (
+    CODEC_OPTIONS,
+    RAW_CODEC_OPTIONS,
+    find_by_ids,
+    local_time,
+    mongo_to_dict,
+    with_datetimes,
+)
+from ..cache import SingleFlight, single_flight
 
-lessons_collection = db.get_collection("lessons")
+lessons_collection = db.get_collection("lessons", codec_options=CODEC_OPTIONS)
+raw_lessons_collection = lessons_collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+lessons_flights = SingleFlight()
+versions.add_listener("lessons", lessons_flights.clear)
+
+listeners: List[Callable[[str, Optional[dict]], None]] = []
+
+
+def add_listener(listener: Callable[[str, Optional[dict]], None]):
+    """ Call listener with the id and the new value of every lesson written by
+    this worker, the value is None for deleted lessons """
+
+    listeners.append(listener)
+
+
+def _written(lesson_id, lesson: Optional[dict]):
+    for listener in listeners:
+        listener(str(lesson_id), lesson)
 
 
 class Lesson(BaseModel):
@@ -62,95 +93,165 @@ class Lesson(BaseModel):
     start_time: str = Field(..., description="Start time of the lesson", example="9:30")
     end_time: str = Field(..., description="End time of the lesson", example="10:50")
 
+    start: datetime = Field(
+        None, description="Start of the lesson, filled in from date and start_time"
+    )
+    end: datetime = Field(None, description="End of the lesson, filled in from date and end_time")
+
     class Config:
         extra = "allow"
 
 
-async def get_all() -> List[Dict[str, Union[str, int]]]:
-    """ Get all lessons from db """
+@single_flight(lessons_flights)
+async def get_all(
+    projection: Optional[dict] = None, raw: bool = False
+) -> List[Dict[str, Union[str, int]]]:
+    """ Get all lessons from db, as RawBSONDocuments if raw """
 
-    return [mongo_to_dict(lesson) async for lesson in lessons_collection.find()]
+    collection = raw_lessons_collection if raw else lessons_collection
+    return await collection.find({}, projection).to_list(None)
 
 
-async def sort_many(attributes: dict) -> Optional[List[Dict[str, Union[str, int]]]]:
-    """ Get lesson by its ruz name and datetime or any of it's attributes """
+@single_flight(lessons_flights)
+async def sort_many(
+    attributes: dict, projection: Optional[dict] = None, raw: bool = False
+) -> Optional[List[Dict[str, Union[str, int]]]]:
+    """ Get lesson by its ruz name and datetime or any of it's attributes,
+    as RawBSONDocuments if raw """
 
     fromdate = attributes.pop("fromdate", None)
     todate = attributes.pop("todate", None)
 
+    # Lessons that are held completely between fromdate and todate.
+    # Stored datetimes are naive local time, so are the bounds
     if fromdate:
-        attributes["date"] = {
-            "$gte": str(fromdate.date()),
-        }
-        attributes["start_time"] = {"$gte": str(fromdate.time())}
+        attributes["start"] = {"$gte": local_time(fromdate)}
 
     if todate:
-        attributes.setdefault("date", {})
-        attributes["date"]["$lte"] = str(todate.date())
-
-        attributes.setdefault("start_time", {})
-        attributes["start_time"]["$lte"] = str(todate.time())
-
-    if fromdate and todate:
-        attributes.pop("start_time", None)
-        attributes.pop("date", None)
-        attributes.setdefault("$and", [])
-        if str(todate.date()) != str(fromdate.date()):
-            attributes["$and"].append({"date": {"$lte": str(todate.date())}})
-            attributes["$and"].append({"date": {"$gte": str(fromdate.date())}})
-        else:
-            attributes["$and"].append({"start_time": {"$gte": str(fromdate.time())}})
-            attributes["$and"].append({"end_time": {"$lte": str(todate.time())}})
+        attributes.setdefault("start", {})
+        attributes["start"]["$lt"] = local_time(todate)
+        attributes["end"] = {"$lte": local_time(todate)}
 
     logger.info(f"lessons.sort_many got filter obj: {attributes}")
 
-    return [
-        mongo_to_dict(lesson) async for lesson in lessons_collection.find(attributes)
-    ]
+    collection = raw_lessons_collection if raw else lessons_collection
+    return await collection.find(attributes, projection).to_list(None)
 
 
+@single_flight(lessons_flights)
 async def get_by_id(lesson_id: ObjectId) -> Optional[Dict[str, Union[str, int]]]:
     """ Get lesson by its db id """
 
-    lesson = await lessons_collection.find_one({"_id": lesson_id})
-    if lesson:
-        return mongo_to_dict(lesson)
+    return await lessons_collection.find_one({"_id": lesson_id})
+
+
+@single_flight(lessons_flights)
+async def get_many(
+    ids: List[ObjectId], projection: Optional[dict] = None, raw: bool = False
+) -> list:
+    """ Get lessons by their db ids, in the order of ids, as RawBSONDocuments if raw """
+
+    collection = raw_lessons_collection if raw else lessons_collection
+    return await find_by_ids(collection, ids, projection)
 
 
 async def get_by_ruz_id(ruz_lesson_oid: int) -> Optional[Dict[str, Union[str, int]]]:
     """ Get lesson by its id in RUZ """
 
-    lesson = await lessons_collection.find_one({"ruz_lesson_oid": ruz_lesson_oid})
-    if lesson:
-        return mongo_to_dict(lesson)
+    return await lessons_collection.find_one({"ruz_lesson_oid": ruz_lesson_oid})
 
 
 async def add(lesson: dict) -> Dict[str, Union[str, int]]:
     """ Add lesson to db """
 
-    lesson_added = await lessons_collection.insert_one(lesson)
-    new = await lessons_collection.find_one({"_id": lesson_added.inserted_id})
+    lesson["revision"] = revisions.next_revision()
+    await lessons_collection.insert_one(with_datetimes(lesson))  # sets lesson["_id"]
+    versions.bump("lessons")
+    lesson = mongo_to_dict(lesson)
+    _written(lesson["id"], lesson)
+    return lesson
 
-    return mongo_to_dict(new)
 
+def _upsert_pipeline(lesson: dict, revision: int) -> List[dict]:
+    # The revision is stamped here, one sent with the lesson is not kept
+    values = {
+        key: {"$literal": value} for key, value in lesson.items() if key not in ("_id", "revision")
+    }
+    unchanged = {"$and": [{"$eq": [f"${key}", value]} for key, value in values.items()]}
+
+    return [
+        {"$set": {"revision": {"$cond": [unchanged, "$revision", revision]}}},
+        {"$set": values},
+    ]
 
-async def add_empty(lesson_id: ObjectId):
-    """ Add empty lesson with specified id to db """
 
-    await lessons_collection.insert_one({"_id": lesson_id})
+async def upsert_many(lessons: List[dict], ordered: bool = False) -> List[Dict[str, str]]:
+    """ Add or update lessons by their ruz_lesson_oid in a single bulk write """
+
+    if not lessons:
+        return []
+
+    # Unchanged lessons keep their revision, so nightly syncs do not resend them
+    last_revision = revisions.next_revision(len(lessons))
+    requests = [
+        UpdateOne(
+            {"ruz_lesson_oid": lesson["ruz_lesson_oid"]},
+            _upsert_pipeline(with_datetimes(lesson), last_revision - len(lessons) + 1 + index),
+            upsert=True,
+        )
+        for index, lesson in enumerate(lessons)
+    ]
+    # Replies are decoded by the collection codec, upserted _id are read from them
+    collection = lessons_collection.with_options(codec_options=DEFAULT_CODEC_OPTIONS)
+    try:
+        result = (await collection.bulk_write(requests, ordered=ordered)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+    versions.bump("lessons")
+    if listeners:
+        # Ids of the updated lessons are not in the reply
+        oids = [lesson["ruz_lesson_oid"] for lesson in lessons]
+        async for lesson in lessons_collection.find({"ruz_lesson_oid": {"$in": oids}}):
+            _written(lesson["id"], lesson)
+
+    errors = {error["index"]: error["errmsg"] for error in result["writeErrors"]}
+    upserted = {upsert["index"]: upsert["_id"] for upsert in result["upserted"]}
+
+    statuses = []
+    for index in range(len(lessons)):
+        if index in errors:
+            statuses.append({"status": "error", "message": errors[index]})
+        elif ordered and errors and index > min(errors):
+            # Ordered bulk writes stop at the first error
+            statuses.append({"status": "skipped"})
+        elif index in upserted:
+            statuses.append({"status": "created", "id": str(upserted[index])})
+        else:
+            statuses.append({"status": "updated"})
+
+    return statuses
 
 
 async def remove(lesson_id: ObjectId):
     """ Delete lesson from db """
 
+    revision = revisions.next_revision()
     res = await lessons_collection.delete_one({"_id": lesson_id})
+    if res.deleted_count:
+        await revisions.add_tombstone("lessons", lesson_id, revision)
+        _written(lesson_id, None)
+    versions.bump("lessons")
     return res
 
 
-async def put(lesson_id: ObjectId, new_values: dict):
-    """ Update lesson """
+async def put(lesson_id: ObjectId, new_values: dict) -> Optional[Dict[str, Union[str, int]]]:
+    """ Replace lesson with new values, returns None if there is no such lesson """
 
-    await lessons_collection.update_one(
-        {"_id": lesson_id},
-        {"$set": new_values},
+    new_values["revision"] = revisions.next_revision()
+    lesson = await lessons_collection.find_one_and_replace(
+        {"_id": lesson_id}, with_datetimes(new_values), return_document=ReturnDocument.AFTER
     )
+    versions.bump("lessons")
+    if lesson is not None:
+        _written(lesson_id, lesson)
+    return lesson
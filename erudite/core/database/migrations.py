@@ -0,0 +1,35 @@
+""" Data migrations
+
+They are safe to run more than once. Run from the erudite directory:
+
+    python -m core.database.migrations
+"""
+
+import asyncio
+from functools import partial
+
+from loguru import logger
+
+from . import rooms, equipment, disciplines, lessons, records
+from .revisions import backfill_revisions
+from .utils import backfill_datetimes
+
+
+MIGRATIONS = {
+    "lessons: start and end datetimes": partial(backfill_datetimes, lessons.lessons_collection),
+    "records: start and end datetimes": partial(backfill_datetimes, records.records_collection),
+    "rooms: revisions": partial(backfill_revisions, rooms.rooms_collection),
+    "equipment: revisions": partial(backfill_revisions, equipment.equipment_collection),
+    "disciplines: revisions": partial(backfill_revisions, disciplines.disciplines_collection),
+    "lessons: revisions": partial(backfill_revisions, lessons.lessons_collection),
+    "records: revisions": partial(backfill_revisions, records.records_collection),
+}
+
+
+async def main():
+    for name, migration in MIGRATIONS.items():
+        logger.info(f"Migration {name}: {await migration()} documents updated")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import motor.motor_asyncio
 
 from ..settings import settings
@@ -19,3 +19,11 @@ else:
 
 class Message(BaseModel):
     message: str
+
+
+class BulkResult(BaseModel):
+    status: str = Field(
+        ..., description="created, updated, duplicate, error or skipped", example="created"
+    )
+    id: str = Field(None, description="ObjectId of the created document")
+    message: str = Field(None, description="Why the item was not written")
@@ -2,12 +2,30 @@ from loguru import logger
 from typing import Dict, Optional, List, Union
 from pydantic import BaseModel, Field
 from bson.objectid import ObjectId
-from datetime import timedelta, datetime
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
 
 from .models import db
-from .utils import mongo_to_dict
-
-records_collection = db.get_collection("records")
+from . import revisions, versions
+from .utils import (
+    CODEC_OPTIONS,
+    RAW_CODEC_OPTIONS,
+    duplicate_message,
+    find_by_ids,
+    local_time,
+    mongo_to_dict,
+    with_datetimes,
+)
+from ..settings import settings
+from ..cache import SingleFlight, TTLCache, cached, single_flight
+
+records_collection = db.get_collection("records", codec_options=CODEC_OPTIONS)
+raw_records_collection = records_collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+
+stats_cache = TTLCache(maxsize=settings.stats_cache_size, ttl=settings.stats_cache_ttl)
+versions.add_listener("records", stats_cache.clear)
+records_flights = SingleFlight()
+versions.add_listener("records", records_flights.clear)
 
 
 class Record(BaseModel):
@@ -26,85 +44,103 @@ class Record(BaseModel):
 
     keywords: List[str] = Field(None, description="Keywords from record audio")
 
+    start: datetime = Field(
+        None, description="Start of record, filled in from date and start_time"
+    )
+    end: datetime = Field(None, description="End of record, filled in from date and end_time")
+
     class Config:
         extra = "allow"
 
 
+class RecordStats(BaseModel):
+    key: str = Field(
+        None, description="Room name, type of record or date bucket", example="504"
+    )
+    count: int = Field(..., description="Number of records", example=120)
+    hours: float = Field(..., description="Total recorded hours", example=160.5)
+    keywords_share: float = Field(
+        ..., description="Share of records with keywords, from 0 to 1", example=0.75
+    )
+
+
 rec_types = ["Jitsi", "MS Teams", "Offline", "Autorecord"]
 
+# Records are shorter, as an end before the start is taken for the next day.
+# Overlap queries bound start from below with it, not only from above
+MAX_RECORD_DURATION = timedelta(days=1)
+
 
+@single_flight(records_flights)
 async def get_all(
     page_number: int,
     page_size: int = 50,
     with_keywords_only: bool = False,
     ignore_autorec: bool = False,
+    after: Optional[Dict[str, Union[str, ObjectId]]] = None,
+    projection: Optional[dict] = None,
+    raw: bool = False,
 ) -> List[Dict[str, str]]:
+    """ Get a page of records, newest first, by its number or after the last record seen.
+    Records are RawBSONDocuments if raw """
+
     attributes = {}
     if ignore_autorec:
         attributes["type"] = {"$in": rec_types[:-1]}
     if with_keywords_only:
         attributes["keywords"] = {"$type": "array", "$not": {"$size": 0}}
+    if after:
+        attributes["$or"] = [
+            {"date": {"$lt": after["date"]}},
+            {"date": after["date"], "_id": {"$lt": after["id"]}},
+        ]
 
-    return [
-        mongo_to_dict(record)
-        async for record in records_collection.find(attributes)
-        .sort("_id", 1)
-        .sort("date", -1)
-        .skip(page_number * page_size if page_number > 0 else 0)
-        .limit(page_size)
-    ]
+    collection = raw_records_collection if raw else records_collection
+    cursor = collection.find(attributes, projection).sort([("date", -1), ("_id", -1)])
+    if not after:
+        cursor = cursor.skip(page_number * page_size if page_number > 0 else 0)
+
+    return await cursor.limit(page_size).to_list(None)
 
 
 async def get_by_url(url: str) -> Optional[Dict[str, Union[str, int]]]:
-    record = await records_collection.find_one({"url": url})
-    if record:
-        return mongo_to_dict(record)
+    return await records_collection.find_one({"url": url})
+
 
+def _interval_filter(attributes: dict) -> dict:
+    """ Replace fromdate and todate with a filter of records that overlap the
+    interval between them, it is served by the (start, end) indexes """
 
+    fromdate = attributes.pop("fromdate", None)
+    todate = attributes.pop("todate", None)
+
+    # Stored datetimes are naive local time, so are the bounds
+    if fromdate:
+        fromdate = local_time(fromdate)
+        attributes["end"] = {"$gt": fromdate}
+        attributes["start"] = {"$gt": fromdate - MAX_RECORD_DURATION}
+
+    if todate:
+        attributes.setdefault("start", {})["$lt"] = local_time(todate)
+
+    return attributes
+
+
+@single_flight(records_flights)
 async def sort_many(
     attributes: dict,
     page_number: int,
     page_size: int = 50,
     with_keywords_only: bool = False,
     ignore_autorec: bool = False,
+    after: Optional[Dict[str, Union[str, ObjectId]]] = None,
+    projection: Optional[dict] = None,
+    raw: bool = False,
 ) -> Optional[List[Dict[str, str]]]:
-    fromdate = attributes.pop("fromdate", None)
-    todate = attributes.pop("todate", None)
+    """ Get a page of filtered records by its number or after the last record seen.
+    Records are RawBSONDocuments if raw """
 
-    if fromdate:
-        attributes["end_point"] = {"$gte": str(fromdate)}
-
-    if todate:
-        attributes["start_point"] = {"$lte": str(todate)}
-
-    if fromdate and todate:
-        attributes.pop("end_point", None)
-        attributes.setdefault("$or", [])
-
-        attributes["$or"].append(
-            {
-                "$and": [
-                    {"end_point": {"$gte": str(fromdate)}},
-                    {"end_point": {"$lte": str(todate)}},
-                ]
-            }
-        )
-        attributes["$or"].append(
-            {
-                "$and": [
-                    {"end_point": {"$gte": str(todate)}},
-                    {"start_point": {"$lte": str(fromdate)}},
-                ]
-            }
-        )
-        attributes["$or"].append(
-            {
-                "$and": [
-                    {"start_point": {"$gte": str(fromdate)}},
-                    {"start_point": {"$lte": str(fromdate)}},
-                ]
-            }
-        )
+    _interval_filter(attributes)
 
     logger.info(
         f"records.sort_many got filter obj: {attributes}, page_number: {page_number}, page_size: {page_size}, "
@@ -115,36 +151,263 @@ async def sort_many(
         attributes["type"] = {"$in": rec_types[:-1]}
     if with_keywords_only:
         attributes["keywords"] = {"$type": "array", "$not": {"$size": 0}}
+    if after:
+        attributes["_id"] = {"$gt": after["id"]}
 
-    return [
-        mongo_to_dict(record)
-        async for record in records_collection.find(attributes)
-        .sort("_id", 1)
+    collection = raw_records_collection if raw else records_collection
+    cursor = collection.find(attributes, projection).sort("_id", 1)
+    if not after:
+        cursor = cursor.skip(page_number * page_size if page_number > 0 else 0)
+
+    return await cursor.limit(page_size).to_list(None)
+
+
+@single_flight(records_flights)
+async def search(
+    text: str,
+    attributes: dict,
+    page_number: int,
+    page_size: int = 50,
+    projection: Optional[dict] = None,
+) -> List[Dict[str, Union[str, float]]]:
+    """ Get a page of filtered records whose keywords match the text, most relevant first.
+    Relevance is returned as score """
+
+    attributes = _interval_filter(attributes)
+    attributes["$text"] = {"$search": text}
+
+    score = {"score": {"$meta": "textScore"}}
+    cursor = (
+        records_collection.find(attributes, {**projection, **score} if projection else score)
+        .sort([("score", {"$meta": "textScore"}), ("_id", -1)])
         .skip(page_number * page_size if page_number > 0 else 0)
         .limit(page_size)
+    )
+
+    return await cursor.to_list(None)
+
+
+# Group keys of records statistics, date buckets are taken from start
+stats_groups = {
+    "room": "$room_name",
+    "type": "$type",
+    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$start"}},
+    "week": {"$dateToString": {"format": "%G-W%V", "date": "$start"}},
+    "month": {"$dateToString": {"format": "%Y-%m", "date": "$start"}},
+}
+
+
+@cached(stats_cache)
+@single_flight(records_flights)
+async def stats(group_by: str, attributes: dict) -> List[Dict[str, Union[str, int, float]]]:
+    """ Count records, their total hours and share with keywords per group """
+
+    attributes = _interval_filter(dict(attributes))
+    if group_by not in ("room", "type"):
+        # Records without start have no date bucket
+        attributes.setdefault("start", {})["$type"] = "date"
+
+    has_keywords = {
+        "$gt": [{"$size": {"$cond": [{"$isArray": "$keywords"}, "$keywords", []]}}, 0]
+    }
+    pipeline = [
+        {"$match": attributes},
+        {
+            "$group": {
+                "_id": stats_groups[group_by],
+                "count": {"$sum": 1},
+                # Records without start or end are counted, but add no hours
+                "milliseconds": {"$sum": {"$subtract": ["$end", "$start"]}},
+                "with_keywords": {"$sum": {"$cond": [has_keywords, 1, 0]}},
+            }
+        },
+        {"$sort": {"_id": 1}},
+        # _id of the groups is not an ObjectId, keep the codec from rewriting it
+        {"$project": {"_id": 0, "key": "$_id", "count": 1, "milliseconds": 1, "with_keywords": 1}},
     ]
 
+    return [
+        {
+            "key": group["key"],
+            "count": group["count"],
+            "hours": round(group["milliseconds"] / 3_600_000, 2),
+            "keywords_share": round(group["with_keywords"] / group["count"], 4),
+        }
+        async for group in records_collection.aggregate(pipeline)
+    ]
 
+
+@single_flight(records_flights)
 async def get_by_id(record_id: ObjectId) -> Optional[Dict[str, str]]:
-    record = await records_collection.find_one({"_id": record_id})
-    if record:
-        return mongo_to_dict(record)
+    return await records_collection.find_one({"_id": record_id})
+
+
+@single_flight(records_flights)
+async def get_many(
+    ids: List[ObjectId], projection: Optional[dict] = None, raw: bool = False
+) -> list:
+    """ Get records by their db ids, in the order of ids, as RawBSONDocuments if raw """
+
+    collection = raw_records_collection if raw else records_collection
+    return await find_by_ids(collection, ids, projection)
 
 
 async def add(record: Dict[str, str]) -> Dict[str, str]:
-    record_added = await records_collection.insert_one(record)
-    new_record = await records_collection.find_one({"_id": record_added.inserted_id})
+    record["revision"] = revisions.next_revision()
+    await records_collection.insert_one(with_datetimes(record))  # sets record["_id"]
+    versions.bump("records")
+    return mongo_to_dict(record)
+
+
+def _overlap_filter(record: Dict[str, str]) -> dict:
+    return {
+        "room_name": record["room_name"],
+        "camera_ip": record.get("camera_ip"),
+        "start": {"$gt": record["start"] - MAX_RECORD_DURATION, "$lt": record["end"]},
+        "end": {"$gt": record["start"]},
+    }
+
+
+async def overlaps(record: Dict[str, str]) -> bool:
+    """ Check if a record from the same room and camera overlaps this one in time """
+
+    record = with_datetimes(record)
+    if record["start"] is None or record["end"] is None:
+        return False
+
+    return await records_collection.find_one(_overlap_filter(record), {"_id": 1}) is not None
+
+
+async def add_many(records: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """ Add records skipping the ones with a taken url and Autorecords
+    overlapping a record from the same room and camera """
+
+    statuses = [None] * len(records)
+
+    urls = [record["url"] for record in records if record.get("url")]
+    taken_urls = set()
+    if urls:
+        async for record in records_collection.find({"url": {"$in": urls}}, {"url": 1}):
+            taken_urls.add(record["url"])
+
+    for index, record in enumerate(records):
+        url = record.get("url")
+        if not url:
+            continue
+
+        if url in taken_urls:
+            message = f"Record with url: {url}  -  already exists in the database"
+            statuses[index] = {"status": "duplicate", "message": message}
+        taken_urls.add(url)
+
+    for record in records:
+        with_datetimes(record)
+
+    autorecords = {
+        index
+        for index, record in enumerate(records)
+        if statuses[index] is None
+        and record.get("type") == "Autorecord"
+        and record.get("start") is not None
+        and record.get("end") is not None
+    }
+    if autorecords:
+        overlap_filter = {"$or": [_overlap_filter(records[index]) for index in autorecords]}
+        projection = {"room_name": 1, "camera_ip": 1, "start": 1, "end": 1}
+        taken_ranges = [
+            (record["room_name"], record.get("camera_ip"), record["start"], record["end"])
+            async for record in records_collection.find(overlap_filter, projection)
+        ]
+
+        for index, record in enumerate(records):
+            if statuses[index] is not None or None in (record.get("start"), record.get("end")):
+                continue
+
+            room_name, camera_ip = record.get("room_name"), record.get("camera_ip")
+            start, end = record["start"], record["end"]
+            if index in autorecords and any(
+                (taken_room, taken_camera) == (room_name, camera_ip)
+                and taken_start < end
+                and taken_end > start
+                for taken_room, taken_camera, taken_start, taken_end in taken_ranges
+            ):
+                message = (
+                    "Record that was done in the same room, by the same camera, "
+                    "at the same time already exists in the database"
+                )
+                statuses[index] = {"status": "duplicate", "message": message}
+            else:
+                # Later Autorecords of the batch must not overlap this record either
+                taken_ranges.append((room_name, camera_ip, start, end))
+
+    new_indexes = [index for index, status in enumerate(statuses) if status is None]
+    if not new_indexes:
+        return statuses
+
+    last_revision = revisions.next_revision(len(new_indexes))
+    for position, index in enumerate(new_indexes):
+        records[index]["revision"] = last_revision - len(new_indexes) + 1 + position
+
+    errors = {}
+    try:
+        await records_collection.insert_many(
+            [records[index] for index in new_indexes], ordered=False
+        )
+    except BulkWriteError as e:
+        errors = {error["index"]: error for error in e.details["writeErrors"]}
+    versions.bump("records")
 
-    return mongo_to_dict(new_record)
+    for position, index in enumerate(new_indexes):
+        error = errors.get(position)
+        if error is None:
+            statuses[index] = {"status": "created", "id": str(records[index]["_id"])}
+        elif error["code"] == 11000:  # url was taken while the batch was checked
+            message = duplicate_message("Record", error)
+            statuses[index] = {"status": "duplicate", "message": message}
+        else:
+            statuses[index] = {"status": "error", "message": error["errmsg"]}
+
+    return statuses
 
 
 async def add_empty(record_id: ObjectId):
-    await records_collection.insert_one({"_id": record_id})
+    await records_collection.insert_one({"_id": record_id, "revision": revisions.next_revision()})
+    versions.bump("records")
 
 
 async def remove(record_id: ObjectId):
-    await records_collection.delete_one({"_id": record_id})
+    revision = revisions.next_revision()
+    result = await records_collection.delete_one({"_id": record_id})
+    if result.deleted_count:
+        await revisions.add_tombstone("records", record_id, revision)
+    versions.bump("records")
 
 
 async def patch(record_id: ObjectId, new_values: Dict[str, str]):
-    await records_collection.update_one({"_id": record_id}, {"$set": new_values})
+    fields = ["date", "start_time", "end_time"]
+
+    new_values["revision"] = revisions.next_revision()
+
+    if not new_values.keys() & set(fields):
+        await records_collection.update_one({"_id": record_id}, {"$set": new_values})
+
+    # Start and end are set in the same update as the date and time strings they
+    # are made of. It only goes through if the strings are still those that were
+    # read, otherwise they are read again
+    while new_values.keys() & set(fields):
+        record = await records_collection.find_one(
+            {"_id": record_id}, {field: 1 for field in fields}
+        )
+        if record is None:
+            break
+
+        current = {field: record.get(field) for field in fields}
+        patched = with_datetimes({**current, **new_values})
+        result = await records_collection.update_one(
+            {"_id": record_id, **current},
+            {"$set": {**new_values, "start": patched["start"], "end": patched["end"]}},
+        )
+        if result.matched_count:
+            break
+
+    versions.bump("records")
@@ -0,0 +1,135 @@
+""" Revisions for incremental sync
+
+Every write stamps the documents it touches with a revision, deletes leave a
+tombstone stamped the same way. Clients that remember the last revision they
+have seen pull only what changed after it.
+
+Revisions are made of the time they were taken at, in milliseconds, and a
+counter, so taking one costs no round trip. Revisions are taken before the
+write and writes may finish in any order, so changes are only sent once
+their revision is `revision_lag` seconds old. Otherwise a client could move
+past a revision that is written after its pull. Workers' clocks have to
+agree within that lag, and revisions of the same time may repeat.
+"""
+
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Union
+
+from bson.codec_options import DEFAULT_CODEC_OPTIONS
+from pymongo import ASCENDING, UpdateOne
+
+from .models import db
+from ..settings import settings
+
+tombstones_collection = db.get_collection("tombstones")
+
+# Revisions taken in the same millisecond, more of them take the next ones.
+# Revisions stay below 2 ** 53, so JSON clients read them exactly
+COUNTER_BITS = 10
+
+last_revision = 0
+
+
+def next_revision(count: int = 1) -> int:
+    """ Take `count` revisions for a write, returns the last of them """
+
+    global last_revision
+
+    now = int(time.time() * 1000) << COUNTER_BITS
+    last_revision = max(last_revision, now - 1) + count
+    return last_revision
+
+
+def committed_revision() -> int:
+    """ Get the revision up to which all writes are taken for done """
+
+    lag = int((time.time() - settings.revision_lag) * 1000)
+    return ((lag + 1) << COUNTER_BITS) - 1
+
+
+async def add_tombstone(collection: str, document_id: Any, revision: int):
+    """ Remember that the document was deleted """
+
+    await tombstones_collection.insert_one(
+        {
+            "collection": collection,
+            "document_id": str(document_id),
+            "revision": revision,
+            "deleted_at": datetime.utcnow(),
+        }
+    )
+
+
+async def changed_since(
+    collection, name: str, since: int, limit: int = settings.sync_batch_size
+) -> Dict[str, Union[int, bool, List]]:
+    """ Get documents written and ids of documents deleted after the `since`
+    revision, oldest first. At most `limit` changes are returned, `more` tells
+    to pull again from the returned revision """
+
+    query = {"revision": {"$gt": since, "$lte": committed_revision()}}
+    documents = (
+        await collection.find(query).sort("revision", ASCENDING).limit(limit + 1).to_list(None)
+    )
+    tombstones = (
+        await tombstones_collection.find(
+            {"collection": name, **query}, {"_id": 0, "document_id": 1, "revision": 1}
+        )
+        .sort("revision", ASCENDING)
+        .limit(limit + 1)
+        .to_list(None)
+    )
+
+    revisions = sorted(change["revision"] for change in documents + tombstones)
+    more = len(revisions) > limit
+    revision = revisions[limit - 1] if more else (revisions[-1] if revisions else since)
+
+    # The next pull starts after `revision`, so a page must not end inside it
+    if more and revisions[limit] == revision:
+        documents = [document for document in documents if document["revision"] < revision]
+        documents += await collection.find({"revision": revision}).to_list(None)
+        tombstones = [tombstone for tombstone in tombstones if tombstone["revision"] < revision]
+        tombstones += await tombstones_collection.find(
+            {"collection": name, "revision": revision}, {"_id": 0, "document_id": 1, "revision": 1}
+        ).to_list(None)
+
+    documents = [document for document in documents if document["revision"] <= revision]
+    # A document deleted and then written again is sent only as a document
+    written = {document["id"]: document["revision"] for document in documents}
+    deleted = [
+        tombstone["document_id"]
+        for tombstone in tombstones
+        if tombstone["revision"] <= revision
+        and tombstone["revision"] > written.get(tombstone["document_id"], 0)
+    ]
+
+    return {"revision": revision, "more": more, "documents": documents, "deleted": deleted}
+
+
+async def backfill_revisions(collection, batch_size: int = settings.sync_batch_size) -> int:
+    """ Stamp documents written before revisions were kept, each with a
+    revision of its own """
+
+    collection = collection.with_options(codec_options=DEFAULT_CODEC_OPTIONS)
+
+    updated = 0
+    while True:
+        ids = [
+            document["_id"]
+            async for document in collection.find(
+                {"revision": {"$exists": False}}, {"_id": 1}
+            ).limit(batch_size)
+        ]
+        if not ids:
+            return updated
+
+        last_revision = next_revision(len(ids))
+        requests = [
+            UpdateOne(
+                {"_id": id, "revision": {"$exists": False}},
+                {"$set": {"revision": last_revision - len(ids) + 1 + index}},
+            )
+            for index, id in enumerate(ids)
+        ]
+        updated += (await collection.bulk_write(requests, ordered=False)).modified_count
@@ -1,12 +1,25 @@
 from pydantic import BaseModel, Field
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 
 from ..database.models import db
-from ..database.utils import mongo_to_dict
+from ..database import revisions, versions
+from ..settings import settings
+from ..database.utils import CODEC_OPTIONS, find_by_ids, mongo_to_dict
+from ..cache import SingleFlight, TTLCache, cached, single_flight
 
 
-rooms_collection = db.get_collection("rooms")
+rooms_collection = db.get_collection("rooms", codec_options=CODEC_OPTIONS)
+
+rooms_cache = TTLCache(maxsize=settings.catalog_cache_size, ttl=settings.catalog_cache_ttl)
+versions.add_listener("rooms", rooms_cache.clear)
+rooms_flights = SingleFlight()
+versions.add_listener("rooms", rooms_flights.clear)
+# Rooms with their equipment embedded are read from both collections
+expanded_flights = SingleFlight()
+versions.add_listener("rooms", expanded_flights.clear)
+versions.add_listener("equipment", expanded_flights.clear)
 
 
 class Room(BaseModel):
@@ -32,67 +45,99 @@ class Room(BaseModel):
         extra = "allow"
 
 
-async def get_all() -> List[Dict[str, Union[str, int]]]:
+@cached(rooms_cache)
+@single_flight(rooms_flights)
+async def get_all(projection: Optional[dict] = None) -> List[Dict[str, Union[str, int]]]:
     """ Get all rooms from db """
 
-    return [mongo_to_dict(room) async for room in rooms_collection.find()]
+    return await rooms_collection.find({}, projection).to_list(None)
 
 
+@cached(rooms_cache)
+@single_flight(rooms_flights)
 async def get(room_id: ObjectId) -> List[Dict[str, Union[str, int]]]:
     """ Get room by its db id """
 
-    room = await rooms_collection.find_one({"_id": room_id})
-    if room:
-        return mongo_to_dict(room)
+    return await rooms_collection.find_one({"_id": room_id})
+
+
+# Not cached, the cache would fill up with one entry per set of ids
+@single_flight(rooms_flights)
+async def get_many(ids: List[ObjectId], projection: Optional[dict] = None) -> list:
+    """ Get rooms by their db ids, in the order of ids """
+
+    return await find_by_ids(rooms_collection, ids, projection)
 
 
 async def get_by_ruz_id(ruz_auditorium_oid: int) -> dict:
     """ Get room by its ruz_auditorium_oid """
 
-    room = await rooms_collection.find_one({"ruz_auditorium_oid": ruz_auditorium_oid})
-    if room:
-        return mongo_to_dict(room)
+    return await rooms_collection.find_one({"ruz_auditorium_oid": ruz_auditorium_oid})
 
 
 async def add(room: dict):
     """ Add room to db """
 
-    room_added = await rooms_collection.insert_one(room)
-    new = await rooms_collection.find_one({"_id": room_added.inserted_id})
-    return mongo_to_dict(new)
-
-
-async def add_empty(room_id: ObjectId):
-    """ Add empty room with specified id to db """
-
-    await rooms_collection.insert_one({"_id": room_id})
+    room["revision"] = revisions.next_revision()
+    await rooms_collection.insert_one(room)  # sets room["_id"]
+    versions.bump("rooms")
+    return mongo_to_dict(room)
 
 
 async def remove(room_id: ObjectId):
     """ Delete room from db """
 
-    await rooms_collection.delete_one({"_id": room_id})
+    revision = revisions.next_revision()
+    result = await rooms_collection.delete_one({"_id": room_id})
+    if result.deleted_count:
+        await revisions.add_tombstone("rooms", room_id, revision)
+    versions.bump("rooms")
 
 
 async def patch(room_id: ObjectId, new_values: dict):
     """ Patch room """
 
+    new_values["revision"] = revisions.next_revision()
     await rooms_collection.update_one({"_id": room_id}, {"$set": new_values})
+    versions.bump("rooms")
 
 
-async def put(room_id: ObjectId, new_values: dict):
-    """ Update room """
+async def put(room_id: ObjectId, new_values: dict) -> Optional[Dict[str, Union[str, int]]]:
+    """ Replace room with new values, returns None if there is no such room """
 
-    await rooms_collection.update_one(
-        {"_id": room_id},
-        {"$set": new_values},
+    new_values["revision"] = revisions.next_revision()
+    room = await rooms_collection.find_one_and_replace(
+        {"_id": room_id}, new_values, return_document=ReturnDocument.AFTER
     )
+    versions.bump("rooms")
+    return room
 
 
-async def sort_many(attributes: dict) -> list:
+@cached(rooms_cache)
+@single_flight(rooms_flights)
+async def sort_many(attributes: dict, projection: Optional[dict] = None) -> list:
     """ Get equipment by its db attributes """
 
-    return [
-        mongo_to_dict(equipment)
-        async for equipment in rooms_collection.find(attributes)
+    return await rooms_collection.find(attributes, projection).to_list(None)
+
+
+@single_flight(expanded_flights)
+async def get_with_equipment(attributes: dict, projection: Optional[dict] = None) -> list:
+    """ Get rooms by their db attributes with a list of their equipment
+    in the `equipment` field, all in one aggregation """
+
+    pipeline = [
+        {"$match": attributes},
+        # Equipment refers to rooms by the string form of their ObjectId
+        {"$addFields": {"_room_id": {"$toString": "$_id"}}},
+        {
+            "$lookup": {
+                "from": "equipment",
+                "localField": "_room_id",
+                "foreignField": "room_id",
+                "as": "equipment",
+            }
+        },
+        {"$project": {**projection, "equipment": 1} if projection else {"_room_id": 0}},
     ]
+    return await rooms_collection.aggregate(pipeline).to_list(None)
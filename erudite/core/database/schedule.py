@@ -0,0 +1,208 @@
+""" In-memory schedule of the rooms
+
+Lessons are kept per room (ruz_auditorium_oid) sorted by start, so the
+current and the next lesson of a room are found by bisect. Lessons written
+by this worker, and with change streams on by anyone, are put in place in
+their room's schedule. The whole schedule is loaded from mongo again after
+`schedule_ttl` seconds, or when the change stream starts over.
+
+Lessons are stored as naive local time of the `timezone` setting, so times
+are converted to it before they are compared. Only lessons that were not
+over when the schedule was loaded are kept, lessons at an earlier time are
+looked up in mongo.
+"""
+
+import asyncio
+import bisect
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+from . import changes, lessons
+from .lessons import lessons_collection
+from .utils import local_time, mongo_to_dict
+from ..settings import settings
+
+
+# Lessons are shorter, older ones can't be held at the moment
+MAX_LESSON_DURATION = timedelta(hours=12)
+
+
+class RoomSchedule:
+    __slots__ = ("starts", "lessons")
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.lessons: List[dict] = []
+
+
+schedules: Dict[int, RoomSchedule] = {}
+# Room and start of every lesson in the schedule, by id
+placed: Dict[str, Tuple[int, datetime]] = {}
+
+expires_at = 0.0
+# Lessons that start after it are all in the schedule
+window_start: Optional[datetime] = None
+
+_lock: Optional[asyncio.Lock] = None
+# Writes seen while the schedule is loaded, to be put on top of it
+_pending: Optional[List[Tuple[str, Optional[dict]]]] = None
+
+
+def is_fresh() -> bool:
+    return time.monotonic() < expires_at
+
+
+def expire():
+    global expires_at
+
+    expires_at = 0.0
+
+
+def _discard(lesson_id: str):
+    if lesson_id not in placed:
+        return
+
+    ruz_auditorium_oid, start = placed.pop(lesson_id)
+    room = schedules[ruz_auditorium_oid]
+    index = bisect.bisect_left(room.starts, start)
+    while index < len(room.starts) and room.starts[index] == start:
+        if room.lessons[index]["id"] == lesson_id:
+            del room.starts[index]
+            del room.lessons[index]
+            return
+        index += 1
+
+
+def _place(lesson: dict):
+    room = schedules.get(lesson.get("ruz_auditorium_oid"))
+    if room is None:
+        room = schedules[lesson.get("ruz_auditorium_oid")] = RoomSchedule()
+
+    index = bisect.bisect_right(room.starts, lesson["start"])
+    room.starts.insert(index, lesson["start"])
+    room.lessons.insert(index, lesson)
+    placed[lesson["id"]] = (lesson.get("ruz_auditorium_oid"), lesson["start"])
+
+
+def apply(lesson_id: str, lesson: Optional[dict]):
+    """ Put the new value of the lesson in place, None removes it """
+
+    if _pending is not None:
+        _pending.append((lesson_id, lesson))
+
+    _discard(lesson_id)
+    if (
+        lesson is not None
+        and window_start is not None
+        and isinstance(lesson.get("start"), datetime)
+        and lesson["start"] > window_start
+    ):
+        _place(lesson)
+
+
+def on_change(change: Optional[dict]):
+    if change is None:
+        # Changes may have been missed
+        expire()
+        return
+
+    document = change.get("fullDocument")
+    apply(str(change["documentKey"]["_id"]), mongo_to_dict(document) if document else None)
+
+
+async def load():
+    """ Load lessons that are not over yet """
+
+    global schedules, placed, expires_at, window_start, _pending
+
+    _pending = []
+    try:
+        rooms = defaultdict(RoomSchedule)
+        lessons_placed = {}
+        start = local_time() - MAX_LESSON_DURATION
+        query = {"start": {"$gt": start}}
+        async for lesson in lessons_collection.find(query).sort("start", 1):
+            room = rooms[lesson.get("ruz_auditorium_oid")]
+            room.starts.append(lesson["start"])
+            room.lessons.append(lesson)
+            lessons_placed[lesson["id"]] = (lesson.get("ruz_auditorium_oid"), lesson["start"])
+
+        schedules, placed = dict(rooms), lessons_placed
+        window_start = start
+        expires_at = time.monotonic() + settings.schedule_ttl
+
+        # The cursor may have read lessons before or after these writes
+        pending, _pending = _pending, None
+        for lesson_id, lesson in pending:
+            apply(lesson_id, lesson)
+    finally:
+        _pending = None
+
+
+lessons.add_listener(apply)
+changes.add_listener("lessons", on_change)
+
+
+async def get_schedule(ruz_auditorium_oid: int) -> Optional[RoomSchedule]:
+    global _lock
+
+    if not is_fresh():
+        if _lock is None:
+            _lock = asyncio.Lock()
+
+        async with _lock:
+            if not is_fresh():
+                await load()
+
+    return schedules.get(ruz_auditorium_oid)
+
+
+async def current_lesson(ruz_auditorium_oid: int, at: datetime) -> Optional[dict]:
+    """ Get lesson that is held in the room at the time """
+
+    room = await get_schedule(ruz_auditorium_oid)
+    # Lessons held at `at` may have started before the loaded ones
+    if at - MAX_LESSON_DURATION < window_start:
+        return await lessons_collection.find_one(
+            {
+                "ruz_auditorium_oid": ruz_auditorium_oid,
+                "start": {"$lte": at, "$gt": at - MAX_LESSON_DURATION},
+                "end": {"$gt": at},
+            },
+            sort=[("start", DESCENDING)],
+        )
+    if room is None:
+        return None
+
+    # The latest started lesson that is not over, lessons may overlap
+    index = bisect.bisect_right(room.starts, at) - 1
+    while index >= 0 and room.starts[index] > at - MAX_LESSON_DURATION:
+        lesson = room.lessons[index]
+        if lesson.get("end") and lesson["end"] > at:
+            return lesson
+        index -= 1
+
+    return None
+
+
+async def next_lesson(ruz_auditorium_oid: int, at: datetime) -> Optional[dict]:
+    """ Get the first lesson in the room that starts after the time """
+
+    room = await get_schedule(ruz_auditorium_oid)
+    if at < window_start:
+        return await lessons_collection.find_one(
+            {"ruz_auditorium_oid": ruz_auditorium_oid, "start": {"$gt": at}},
+            sort=[("start", ASCENDING)],
+        )
+    if room is None:
+        return None
+
+    index = bisect.bisect_right(room.starts, at)
+    if index < len(room.starts):
+        return room.lessons[index]
+
+    return None
@@ -1,11 +1,66 @@
 """ Вспомогательные функции """
 
+import base64
+import json
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
 from loguru import logger
+import orjson
 
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
 from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import UpdateOne
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    from backports.zoneinfo import ZoneInfo
+
+from . import revisions
+from ..settings import settings
+
+
+class Document(dict):
+    """ Document decoded straight into the API shape: `_id` is stored as a string `id`.
+
+    BSON decoding sets every field through __setitem__, so no copy of the document
+    is made. Embedded documents are decoded the same way """
+
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        if key == "_id":
+            dict.__setitem__(self, "id", str(value))
+        else:
+            dict.__setitem__(self, key, value)
+
+
+# Codec options of the collections used by the API. Code that needs ObjectIds back
+# (migrations, change streams, aggregations on _id) works with db or DEFAULT_CODEC_OPTIONS
+CODEC_OPTIONS = CodecOptions(document_class=Document)
+
+# Documents are left as BSON bytes received from the server, to be sent as they are
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+# Datetimes of lessons and records are stored as naive local time of this timezone
+timezone = ZoneInfo(settings.timezone)
+
+
+def local_time(at: Optional[datetime] = None) -> datetime:
+    """ Get the time as naive local time of the stored documents, the current
+    time if none is given. Naive times are taken as local already """
 
+    if at is None:
+        return datetime.now(timezone).replace(tzinfo=None)
+    if at.tzinfo is not None:
+        return at.astimezone(timezone).replace(tzinfo=None)
+    return at
 
-# Schemas to dictionary
+
+# Schemas to dictionary, for documents that were not read from the db
 def mongo_to_dict(obj):
     if obj.get("_id") is None:
         return obj
@@ -37,3 +92,164 @@ def get_not_None_args(all_args: dict) -> dict:
     del all_args
 
     return filter_list
+
+
+# Message of a write that hit a unique index, with the key that is already taken.
+# `details` are those of the DuplicateKeyError or of a bulk write error
+def duplicate_message(name: str, details: Optional[dict]) -> str:
+    details = details or {}
+    values = details.get("keyValue") or {}
+    fields = list(details.get("keyPattern") or values)
+    if not fields:
+        return f"{name} already exists in the database"
+
+    key = ", ".join(f"{field}: '{values.get(field)}'" for field in fields)
+    return f"{name} with {key}  -  already exists in the database"
+
+
+async def find_by_ids(collection, ids: List[ObjectId], projection: Optional[dict] = None) -> list:
+    """ Get documents by their ids with a single $in query, in the order of ids.
+    Repeated ids are returned once, ids that are not found are skipped """
+
+    found = {
+        str(document["_id"]) if isinstance(document, RawBSONDocument) else document["id"]: document
+        async for document in collection.find({"_id": {"$in": ids}}, projection)
+    }
+    return [found[str(id)] for id in dict.fromkeys(ids) if str(id) in found]
+
+
+# Opaque continuation token for keyset pagination
+def encode_cursor(values: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Optional[dict]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        logger.info("Cursor is written in the wrong format")
+        return None
+
+    if isinstance(values, dict):
+        return values
+
+
+async def export_documents(collection, batch_size: int = 1000) -> AsyncIterator[dict]:
+    """ Iterate over all documents of the collection without loading them into memory """
+
+    async for document in collection.find().batch_size(batch_size):
+        yield document
+
+
+# Serialize documents one by one, yielding chunks of about `chunk_size` bytes.
+# Datetimes are written in ISO format, values orjson doesn't know (ObjectId) as strings
+async def json_chunks(
+    documents: AsyncIterator[dict],
+    start: str = "",
+    separator: str = "\n",
+    end: str = "\n",
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[bytes]:
+    chunk = bytearray(start.encode())
+    separator_bytes = separator.encode()
+    first = True
+
+    async for document in documents:
+        if not first:
+            chunk += separator_bytes
+        first = False
+
+        chunk += orjson.dumps(document, default=str)
+        if len(chunk) >= chunk_size:
+            yield bytes(chunk)
+            chunk = bytearray()
+
+    yield bytes(chunk + end.encode())
+
+
+async def bson_chunks(
+    collection, batch_size: int = 1000, chunk_size: int = 64 * 1024
+) -> AsyncIterator[bytes]:
+    """ Documents of the collection as BSON received from mongo, never decoded """
+
+    chunk = []
+    size = 0
+
+    cursor = collection.with_options(codec_options=RAW_CODEC_OPTIONS).find()
+    async for document in cursor.batch_size(batch_size):
+        chunk.append(document.raw)
+        size += len(document.raw)
+        if size >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+
+    yield b"".join(chunk)
+
+
+# "2020-12-15" and "9:30" or "09:30:00" to a datetime
+def parse_datetime(date: str, time: str) -> Optional[datetime]:
+    for time_format in ["%H:%M", "%H:%M:%S"]:
+        try:
+            return datetime.strptime(f"{date} {time}", f"%Y-%m-%d {time_format}")
+        except (TypeError, ValueError):
+            pass
+
+
+# Fill in start and end of a lesson or record from its date and time strings.
+# An end before the start is on the next day (e.g. 23:00 - 01:00)
+def with_datetimes(document: dict) -> dict:
+    document["start"] = parse_datetime(document.get("date"), document.get("start_time"))
+    document["end"] = parse_datetime(document.get("date"), document.get("end_time"))
+
+    if document["start"] is None or document["end"] is None:
+        logger.warning(
+            f"Unreadable date or time: {document.get('date')} "
+            f"{document.get('start_time')} - {document.get('end_time')}"
+        )
+    elif document["end"] < document["start"]:
+        document["end"] += timedelta(days=1)
+
+    return document
+
+
+# Fill in start and end of documents stored before they were introduced, and end
+# of documents that cross midnight but were stored with the end on the same day
+async def backfill_datetimes(collection, batch_size: int = 1000) -> int:
+    collection = collection.with_options(codec_options=DEFAULT_CODEC_OPTIONS)
+
+    async def write(changes: List[tuple]) -> int:
+        # Clients that sync incrementally have to get the new start and end too
+        last_revision = revisions.next_revision(len(changes))
+        first_revision = last_revision - len(changes) + 1
+        requests = [
+            UpdateOne(
+                {"_id": id},
+                {"$set": {"start": start, "end": end, "revision": first_revision + index}},
+            )
+            for index, (id, start, end) in enumerate(changes)
+        ]
+        return (await collection.bulk_write(requests, ordered=False)).modified_count
+
+    updated = 0
+    changes = []
+    query = {
+        "$or": [
+            {"start": {"$exists": False}},
+            {"start": {"$type": "date"}, "$expr": {"$lt": ["$end", "$start"]}},
+        ]
+    }
+    projection = {"date": 1, "start_time": 1, "end_time": 1}
+
+    async for document in collection.find(query, projection):
+        with_datetimes(document)
+        changes.append((document["_id"], document["start"], document["end"]))
+
+        if len(changes) == batch_size:
+            updated += await write(changes)
+            changes = []
+
+    if changes:
+        updated += await write(changes)
+
+    return updated
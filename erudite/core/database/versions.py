@@ -0,0 +1,45 @@
+""" Per-collection change counters
+
+Write helpers bump the counter of their collection. Counters drop
+in-process caches. With change streams on, writes made by other workers
+and other mongo clients bump them too, only then they make ETags of GET
+endpoints.
+"""
+
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List
+
+from . import changes
+
+
+COLLECTIONS = ["rooms", "equipment", "disciplines", "lessons", "records"]
+
+# Random per worker process, so tags issued by other workers never match
+epoch = uuid.uuid4().hex[:8]
+
+counters: Dict[str, int] = defaultdict(int)
+listeners: Dict[str, List[Callable[[], None]]] = defaultdict(list)
+
+
+def add_listener(collection: str, listener: Callable[[], None]):
+    """ Call listener every time the collection changes """
+
+    listeners[collection].append(listener)
+
+
+def bump(collection: str):
+    counters[collection] += 1
+
+    for listener in listeners[collection]:
+        listener()
+
+
+def tag(*collections: str) -> str:
+    """ Version of the collections, changes with any write to them """
+
+    return "-".join([epoch] + [str(counters[collection]) for collection in collections])
+
+
+for collection in COLLECTIONS:
+    changes.add_listener(collection, lambda change, collection=collection: bump(collection))
@@ -1,54 +1,149 @@
+import asyncio
 import logging
-from contextlib import asynccontextmanager
+from typing import Optional
 
-from fastapi import Request, Response
+from fastapi import Response
 from fastapi.responses import JSONResponse
+from prometheus_client import Counter
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 import asyncpg
 
+from .cache import TTLCache
 from .settings import settings
 
 PSQL_DATABASE_ADRESS: str = settings.psql_url
 
 logger = logging.getLogger("erudite")
 
+pool: Optional[asyncpg.pool.Pool] = None
+listener: Optional[asyncpg.Connection] = None
+listener_task: Optional[asyncio.Task] = None
 
-@asynccontextmanager
-async def db_connect():
-    conn = await asyncpg.connect(PSQL_DATABASE_ADRESS)
-    try:
-        yield conn
-    finally:
-        await conn.close()
+# Seconds between checks that the LISTEN connection is still alive
+LISTENER_CHECK_INTERVAL = 10
 
+# API keys that were found in the users table
+key_cache = TTLCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl)
 
-async def authorization(request: Request, call_next):
-    if (
-        request.url.path
-        in [
-            "/api/erudite/docs",
-            "/api/erudite/redoc",
-            "/api/erudite/openapi.json",
-        ]
-        or request.method == "GET"
-    ):
-        return await call_next(request)
+auth_cache_hits = Counter(
+    "erudite_auth_cache_hits", "API keys authorized from the in-process cache"
+)
+auth_cache_misses = Counter(
+    "erudite_auth_cache_misses", "API keys that had to be checked in PostgreSQL"
+)
 
-    api_key = request.headers.get("key")
-    if api_key is None:
-        return JSONResponse(status_code=401, content={"message": "No API key provided"})
 
-    response = await check_key(api_key)
-    if not response.status_code == 200:
-        return response
+async def db_startup():
+    global pool, listener_task
 
-    return await call_next(request)
+    pool = await asyncpg.create_pool(
+        PSQL_DATABASE_ADRESS,
+        min_size=settings.psql_pool_min_size,
+        max_size=settings.psql_pool_max_size,
+    )
+
+    await listen()
+    listener_task = asyncio.create_task(keep_listening())
+
+
+async def db_shutdown():
+    if listener_task is not None:
+        listener_task.cancel()
+
+    if listener is not None:
+        await listener.close()
+
+    if pool is not None:
+        await pool.close()
+
+
+async def listen():
+    global listener
+
+    # LISTEN needs a connection of its own, pooled ones are reset on release
+    listener = await asyncpg.connect(PSQL_DATABASE_ADRESS)
+    await listener.add_listener(settings.auth_notify_channel, on_users_changed)
+
+
+async def keep_listening():
+    """ Check the LISTEN connection and open it again when it drops. Keys are
+    not dropped from the cache while it is down, so the cache is cleared once
+    it is back """
+
+    while True:
+        await asyncio.sleep(LISTENER_CHECK_INTERVAL)
+        try:
+            await asyncio.wait_for(listener.fetchval("SELECT 1"), LISTENER_CHECK_INTERVAL)
+            continue
+        except Exception as e:
+            logger.error(f"Connection listening to {settings.auth_notify_channel} is lost: {e}")
+
+        try:
+            listener.terminate()
+            await listen()
+        except Exception as e:
+            logger.error(f"Connection listening to {settings.auth_notify_channel} failed: {e}")
+            continue
+
+        key_cache.clear()
+        logger.warning(f"Listening to {settings.auth_notify_channel} again, API key cache cleared")
+
+
+def on_users_changed(connection, pid, channel, payload):
+    if payload:
+        key_cache.pop(payload)
+    else:
+        key_cache.clear()
+
+    logger.info(f"API key cache invalidated by {channel}")
+
+
+class AuthorizationMiddleware:
+    """ Lets GET requests and docs through, other requests need a valid API key """
+
+    open_paths = [
+        "/api/erudite/docs",
+        "/api/erudite/redoc",
+        "/api/erudite/openapi.json",
+    ]
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "GET"
+            or scope.get("root_path", "") + scope["path"] in self.open_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        api_key = Headers(scope=scope).get("key")
+        if api_key is None:
+            response = JSONResponse(status_code=401, content={"message": "No API key provided"})
+        else:
+            response = await check_key(api_key)
+
+        if not response.status_code == 200:
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
 
 
 async def check_key(key: str):
-    async with db_connect() as conn:
-        user = await conn.fetchrow("SELECT * FROM users WHERE api_key = $1", key)
+    if key_cache.get(key) is not None:
+        auth_cache_hits.inc()
+    else:
+        auth_cache_misses.inc()
+        async with pool.acquire() as conn:
+            user = await conn.fetchval("SELECT 1 FROM users WHERE api_key = $1", key)
+
+        if not user:
+            return JSONResponse(status_code=401, content={"message": "Invalid API key"})
 
-    if not user:
-        return JSONResponse(status_code=401, content={"message": "Invalid API key"})
+        key_cache.set(key, True)
 
     return Response(status_code=200)
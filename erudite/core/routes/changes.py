@@ -0,0 +1,90 @@
+import json
+from enum import Enum
+from typing import AsyncIterator, List, Optional
+
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from loguru import logger
+from pymongo.errors import PyMongoError
+
+from ..database import changes
+from ..database.models import Message
+from ..database.utils import mongo_to_dict
+from ..settings import settings
+
+
+router = APIRouter()
+
+
+class FeedCollection(str, Enum):
+    lessons = "lessons"
+    records = "records"
+    rooms = "rooms"
+    equipment = "equipment"
+
+
+def event(change: dict) -> bytes:
+    """ Server-sent event of the change, its id is the resume token """
+
+    document = change.get("fullDocument")
+    data = {
+        "operation": change["operationType"],
+        "collection": change["ns"]["coll"],
+        "id": str(change["documentKey"]["_id"]),
+        "document": mongo_to_dict(document) if document else None,
+    }
+
+    return (
+        f"id: {change['_id']['_data']}\n"
+        f"event: {change['ns']['coll']}\n"
+        f"data: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+    ).encode()
+
+
+async def events(
+    collections: List[str], room: Optional[str], resume_after: Optional[dict]
+) -> AsyncIterator[bytes]:
+    try:
+        async for change in changes.feed(collections, room, resume_after):
+            # Comments keep idle connections open through proxies
+            yield event(change) if change else b": keepalive\n\n"
+    except PyMongoError as e:
+        logger.warning(f"Change feed is interrupted: {e}")
+        yield f"event: error\ndata: {json.dumps(str(e))}\n\n".encode()
+
+
+@router.get(
+    "/changes",
+    summary="Follow changes",
+    description=(
+        "Server-sent events with inserted, updated, replaced and deleted documents of the "
+        "collections, of all four if none are given. With `room`, only changes of documents "
+        "in that room are sent (ruz_auditorium of lessons, room_name of records and "
+        "equipment, ruz_number of rooms), deletes are always sent. Every event id is a "
+        "resume token: pass it as Last-Event-ID or `resume_after` to get the changes made "
+        "after it. A client that falls behind is disconnected and should resume"
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {"content": {"text/event-stream": {}}, "description": "Change events"},
+        503: {"model": Message},
+    },
+)
+async def follow_changes(
+    collections: List[FeedCollection] = Query(None),
+    room: Optional[str] = None,
+    resume_after: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    if not settings.change_streams:
+        message = "Change streams are turned off"
+        return JSONResponse(status_code=503, content={"message": message})
+
+    collections = [collection.value for collection in collections or FeedCollection]
+    token = resume_after or last_event_id
+
+    return StreamingResponse(
+        events(collections, room, {"_data": token} if token else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,12 +1,15 @@
 from loguru import logger
 from typing import Optional, List
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi.responses import JSONResponse
 
+from pymongo.errors import DuplicateKeyError
+
 from ..database.models import Message
-from ..database.utils import check_ObjectId
+from ..database.utils import check_ObjectId, duplicate_message
 from ..database import disciplines
+from .utils import changed_since, conditional, projection, since, trusted
 
 
 router = APIRouter()
@@ -20,15 +23,26 @@ router = APIRouter()
     ),
     response_model=List[disciplines.Discipline],
     responses={404: {"model": Message}},
+    dependencies=[Depends(conditional("disciplines"))],
 )
-async def get_disciplines(course_code: Optional[str] = None):
+async def get_disciplines(
+    response: Response,
+    course_code: Optional[str] = None,
+    projection: Optional[dict] = Depends(projection),
+    since: Optional[int] = Depends(since),
+):
+    if since is not None:
+        return await changed_since(
+            disciplines.disciplines_collection, "disciplines", since, response
+        )
+
     if course_code is None:
-        return await disciplines.get_all()
+        return trusted(await disciplines.get_all(projection), response, partial=bool(projection))
 
-    discipline = await disciplines.get_by_cource_code(course_code)
+    discipline = await disciplines.get_by_cource_code(course_code, projection)
     if discipline:
         logger.info(f"Discipline {course_code}: {discipline}")
-        return [discipline]
+        return trusted([discipline], response, partial=bool(projection))
     else:
         message = "This discipline is not found"
         logger.info(message)
@@ -41,6 +55,7 @@ async def get_disciplines(course_code: Optional[str] = None):
     description="Get a discipline specified by it's ObjectId",
     response_model=disciplines.Discipline,
     responses={404: {"model": Message}, 400: {"model": Message}},
+    dependencies=[Depends(conditional("disciplines"))],
 )
 async def find_discipline(discipline_id: str):
     # Check if ObjectId is in the right format
@@ -71,14 +86,14 @@ async def find_discipline(discipline_id: str):
     responses={409: {"model": Message}},
 )
 async def add_discipline(discipline: disciplines.Discipline, request: Request):
-    # Check if discipline with specified ObjectId is in the database
-    if await disciplines.get_by_cource_code(discipline.course_code):
-        message = f"Discipline with code: {discipline.course_code} already exists in the database"
+    # Course code is unique in the database
+    try:
+        return await disciplines.add(await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Discipline", e.details)
         logger.info(message)
         return JSONResponse(status_code=409, content={"message": message})
 
-    return await disciplines.add(await request.json())
-
 
 @router.delete(
     "/disciplines/{discipline_id}",
@@ -112,8 +127,8 @@ async def delete_discipline(discipline_id: str):
     description=(
         "Deletes old atributes of discipline specified by it's ObjectId and puts in new ones"
     ),
-    response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    response_model=disciplines.Discipline,
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def update_discipline(
     discipline_id: str, discipline: disciplines.Discipline, request: Request
@@ -125,15 +140,16 @@ async def update_discipline(
         message = "ObjectId is written in the wrong format"
         return JSONResponse(status_code=400, content={"message": message})
 
-    if await disciplines.get(id):
-        await disciplines.remove(id)
-        await disciplines.add_empty(id)
-        await disciplines.patch_all(id, await request.json())
-        message = f"Discipline: {discipline_id}  -  updated"
-        logger.info(
-            message
-        )  # Если ключа нет в обьекте, то будет добавлена новая пара ключ-значение к этому обьекту
-        return message
+    try:
+        updated_discipline = await disciplines.put(id, await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Discipline", e.details)
+        logger.info(message)
+        return JSONResponse(status_code=409, content={"message": message})
+
+    if updated_discipline:
+        logger.info(f"Discipline: {discipline_id}  -  updated")
+        return updated_discipline
 
     else:
         message = f"Discipline: {discipline_id}  -  not found in the database"
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi.responses import JSONResponse
 from loguru import logger
 from typing import Optional, List
 
+from pymongo.errors import DuplicateKeyError
+
 from ..database.models import Message
-from ..database.utils import check_ObjectId, get_not_None_args
+from ..database.utils import check_ObjectId, get_not_None_args, duplicate_message
 from ..database import equipment
+from .utils import changed_since, conditional, ids, projection, since, trusted
+
 
 router = APIRouter()
 
@@ -18,8 +22,10 @@ router = APIRouter()
     ),
     response_model=List[equipment.Equipment],
     responses={404: {"model": Message}},
+    dependencies=[Depends(conditional("equipment"))],
 )
 async def list_equipments(
+    response: Response,
     name: Optional[str] = None,
     type: Optional[str] = None,
     room_name: Optional[str] = None,
@@ -27,7 +33,17 @@ async def list_equipments(
     ip: Optional[str] = None,
     port: Optional[int] = None,
     rtsp_main: Optional[str] = None,
+    projection: Optional[dict] = Depends(projection),
+    since: Optional[int] = Depends(since),
+    ids: Optional[list] = Depends(ids),
 ):
+    if since is not None:
+        return await changed_since(equipment.equipment_collection, "equipment", since, response)
+
+    if ids is not None:
+        equipment_found = await equipment.get_many(ids, projection)
+        return trusted(equipment_found, response, partial=bool(projection))
+
     if (
         name is None
         and type is None
@@ -37,15 +53,16 @@ async def list_equipments(
         and port is None
         and rtsp_main is None
     ):
-        return await equipment.get_all()
+        return trusted(await equipment.get_all(projection), response, partial=bool(projection))
 
     all_args = locals()
+    del all_args["response"], all_args["projection"], all_args["since"], all_args["ids"]
     filter_args = get_not_None_args(all_args)
 
-    equipment_found = await equipment.sort_many(filter_args)
+    equipment_found = await equipment.sort_many(filter_args, projection)
     if equipment_found:
         logger.info("Equipment found")
-        return equipment_found
+        return trusted(equipment_found, response, partial=bool(projection))
 
     message = "Equipment are not found"
     logger.info(message)
@@ -58,6 +75,7 @@ async def list_equipments(
     description="Get an equipment specified by it's ObjectId",
     response_model=equipment.Equipment,
     responses={404: {"model": Message}},
+    dependencies=[Depends(conditional("equipment"))],
 )
 async def find_equipment(equipment_id: str):
     # Check if ObjectId is in the right format
@@ -90,13 +108,14 @@ async def find_equipment(equipment_id: str):
     responses={409: {"model": Message}},
 )
 async def create_equipment(val_equipment: equipment.Equipment, request: Request):
-    # Check if equipment with specified ObjectId is in the database
-    if await equipment.get_by_name(val_equipment.name):
-        message = f"Equipment with name: '{val_equipment.name}'  -  already exists in the database"
+    # Equipment name is unique in the database
+    try:
+        new_equipment = await equipment.add(await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Equipment", e.details)
         logger.info(message)
         return JSONResponse(status_code=409, content={"message": message})
 
-    new_equipment = await equipment.add(await request.json())
     logger.info(f"Equipment: {val_equipment.name}  -  added to the database")
 
     return new_equipment
@@ -133,7 +152,7 @@ async def delete_equipment(equipment_id: str):
     summary="Patch equipment",
     description="Updates additional atributes of equipment specified by it's ObjectId",
     response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def patch_equipment(equipment_id: str, new_values: dict, request: Request) -> str:
     # Check if ObjectId is in the right format
@@ -144,7 +163,14 @@ async def patch_equipment(equipment_id: str, new_values: dict, request: Request)
         return JSONResponse(status_code=400, content={"message": message})
 
     if await equipment.get(id):
-        await equipment.patch(id, await request.json())
+        new_values = await request.json()
+        try:
+            await equipment.patch(id, new_values)
+        except DuplicateKeyError as e:
+            message = duplicate_message("Equipment", e.details)
+            logger.info(message)
+            return JSONResponse(status_code=409, content={"message": message})
+
         message = f"Equipment {equipment_id} patched"
         logger.info(message)
         return {"message": message}
@@ -158,11 +184,11 @@ async def patch_equipment(equipment_id: str, new_values: dict, request: Request)
     "/equipment/{equipment_id}",
     summary="Update equipment",
     description="Deletes old atributes of equipment and puts in new ones",
-    response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    response_model=equipment.Equipment,
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def update_equipment(
-    equipment_id: str, equipment: equipment.Equipment, request: Request
+    equipment_id: str, val_equipment: equipment.Equipment, request: Request
 ):
     # Check if ObjectId is in the right format
     id = check_ObjectId(equipment_id)
@@ -171,13 +197,16 @@ async def update_equipment(
         message = "ObjectId is written in the wrong format"
         return JSONResponse(status_code=400, content={"message": message})
 
-    if await equipment.get(id):
-        await equipment.remove(id)
-        await equipment.add_empty(id)
-        await equipment.patch(id, await request.json())
-        message = f"Equipment {equipment_id} updated"
+    try:
+        updated_equipment = await equipment.put(id, await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Equipment", e.details)
         logger.info(message)
-        return {"message": message}
+        return JSONResponse(status_code=409, content={"message": message})
+
+    if updated_equipment:
+        logger.info(f"Equipment {equipment_id} updated")
+        return updated_equipment
     else:
         message = f"Equipment {equipment_id} not found in the database"
         logger.info(message)
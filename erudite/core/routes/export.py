@@ -0,0 +1,73 @@
+from enum import Enum
+
+from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+
+from ..database import rooms, equipment, disciplines, lessons, records
+from ..database.utils import bson_chunks, export_documents, json_chunks
+from ..settings import settings
+
+
+router = APIRouter()
+
+
+class Collection(str, Enum):
+    rooms = "rooms"
+    equipment = "equipment"
+    disciplines = "disciplines"
+    lessons = "lessons"
+    records = "records"
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    json = "json"
+    bson = "bson"
+
+
+collections = {
+    Collection.rooms: rooms.rooms_collection,
+    Collection.equipment: equipment.equipment_collection,
+    Collection.disciplines: disciplines.disciplines_collection,
+    Collection.lessons: lessons.lessons_collection,
+    Collection.records: records.records_collection,
+}
+
+
+@router.get(
+    "/export/{collection}",
+    summary="Export a collection",
+    description=(
+        "Stream every document of the collection, one JSON object per line (ndjson) "
+        "or as a single JSON array (json). With bson, documents are sent as stored, "
+        "concatenated BSON documents that are never decoded by the API. Documents are "
+        "read from the database in batches, so the whole collection is never held in memory"
+    ),
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {
+                "application/x-ndjson": {},
+                "application/json": {},
+                "application/bson": {},
+            },
+            "description": "Documents of the collection",
+        }
+    },
+)
+async def export_collection(collection: Collection, format: ExportFormat = ExportFormat.ndjson):
+    if format == ExportFormat.bson:
+        return StreamingResponse(
+            bson_chunks(collections[collection], settings.export_batch_size),
+            media_type="application/bson",
+        )
+
+    documents = export_documents(collections[collection], settings.export_batch_size)
+
+    if format == ExportFormat.json:
+        return StreamingResponse(
+            json_chunks(documents, start="[", separator=",", end="]"),
+            media_type="application/json",
+        )
+
+    return StreamingResponse(json_chunks(documents), media_type="application/x-ndjson")
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request, Response
 from fastapi.responses import JSONResponse
 
 from loguru import logger
@@ -7,9 +7,21 @@ from datetime import datetime
 
 from pydantic import EmailStr
 
-from ..database.models import Message
-from ..database.utils import check_ObjectId, get_not_None_args
+from pymongo.errors import DuplicateKeyError
+
+from ..database.models import Message, BulkResult
+from ..database.utils import check_ObjectId, get_not_None_args, duplicate_message
 from ..database import lessons
+from .utils import (
+    BSON_RESPONSE,
+    changed_since,
+    conditional,
+    ids,
+    projection,
+    since,
+    trusted,
+    wants_bson,
+)
 
 
 router = APIRouter()
@@ -22,8 +34,11 @@ router = APIRouter()
         "Get a list of all lessons in the database, or a lessons in specified room and datetime"
     ),
     response_model=List[lessons.Lesson],
+    responses=BSON_RESPONSE,
+    dependencies=[Depends(conditional("lessons"))],
 )
 async def get_lessons(
+    response: Response,
     ruz_auditorium: Optional[str] = None,
     ruz_auditorium_oid: Optional[int] = None,
     ruz_discipline: Optional[str] = None,
@@ -39,7 +54,18 @@ async def get_lessons(
     gcalendar_calendar_id: Optional[str] = None,
     fromdate: Optional[datetime] = None,
     todate: Optional[datetime] = None,
+    projection: Optional[dict] = Depends(projection),
+    raw: bool = Depends(wants_bson),
+    since: Optional[int] = Depends(since),
+    ids: Optional[list] = Depends(ids),
 ):
+    if since is not None:
+        return await changed_since(lessons.lessons_collection, "lessons", since, response)
+
+    if ids is not None:
+        lessons_found = await lessons.get_many(ids, projection, raw=raw)
+        return trusted(lessons_found, response, partial=bool(projection), raw=raw)
+
     if all(
         p is None
         for p in [
@@ -61,15 +87,19 @@ async def get_lessons(
         ]
     ):
         logger.info("All lessons returned")
-        return await lessons.get_all()
+        return trusted(
+            await lessons.get_all(projection, raw), response, partial=bool(projection), raw=raw
+        )
 
     all_args = locals()
+    del all_args["response"], all_args["projection"], all_args["raw"]
+    del all_args["since"], all_args["ids"]
     filter_args = get_not_None_args(all_args)
 
-    lessons_found = await lessons.sort_many(filter_args)
+    lessons_found = await lessons.sort_many(filter_args, projection, raw)
     if lessons_found:
         logger.info("Lessons found")
-        return lessons_found
+        return trusted(lessons_found, response, partial=bool(projection), raw=raw)
 
     message = "Lessons are not found"
     logger.info(message)
@@ -82,6 +112,7 @@ async def get_lessons(
     description="Get a lesson specified by it's ObjectId",
     response_model=lessons.Lesson,
     responses={400: {"model": Message}, 404: {"model": Message}},
+    dependencies=[Depends(conditional("lessons"))],
 )
 async def get_lesson_by_id(lesson_id: str):
     # Check if ObjectId is in the right format
@@ -110,12 +141,29 @@ async def get_lesson_by_id(lesson_id: str):
     responses={409: {"model": Message}},
 )
 async def add_lesson(lesson: lessons.Lesson, request: Request):
-    if await lessons.get_by_ruz_id(lesson.ruz_lesson_oid):
-        message = f"Lesson with ruz id: {lesson.ruz_lesson_oid}  -  already exists in the database"
+    # Lesson ruz id is unique in the database
+    try:
+        return await lessons.add(await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Lesson", e.details)
         logger.info(message)
         return JSONResponse(status_code=409, content={"message": message})
 
-    return await lessons.add(await request.json())
+
+@router.post(
+    "/lessons/bulk",
+    summary="Create or update many lessons",
+    description=(
+        "Create lessons or update the ones with the same ruz_lesson_oid in a single bulk write. "
+        "Results are returned in the order of the lessons in the request. With ordered=true "
+        "writing stops at the first error and the rest of the lessons are skipped"
+    ),
+    response_model=List[BulkResult],
+)
+async def add_lessons(lessons_list: List[lessons.Lesson], request: Request, ordered: bool = False):
+    results = await lessons.upsert_many(await request.json(), ordered=ordered)
+    logger.info(f"Bulk write of {len(results)} lessons")
+    return results
 
 
 @router.delete(
@@ -154,7 +202,7 @@ async def delete_lesson(lesson_id: str):
     summary="Updates lesson",
     description="Deletes old atributes of lesson specified by it's ObjectId and puts in new ones",
     response_model=lessons.Lesson,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def update_lesson(lesson_id: str, lesson: lessons.Lesson, request: Request):
     # Check if ObjectId is in the right format
@@ -169,13 +217,16 @@ async def update_lesson(lesson_id: str, lesson: lessons.Lesson, request: Request
         message = "Please fill the request body"
         return JSONResponse(status_code=400, content={"message": message})
 
-    if await lessons.get_by_id(id):
-        await lessons.remove(id)
-        await lessons.add_empty(id)
-        await lessons.put(id, new_values)
-        message = f"Lesson: {lesson_id} updated"
+    try:
+        updated_lesson = await lessons.put(id, new_values)
+    except DuplicateKeyError as e:
+        message = duplicate_message("Lesson", e.details)
         logger.info(message)
-        return await request.json()
+        return JSONResponse(status_code=409, content={"message": message})
+
+    if updated_lesson:
+        logger.info(f"Lesson: {lesson_id} updated")
+        return updated_lesson
     # Check if lesson with specified ObjectId is in the database
     else:
         message = f"Lesson: {lesson_id}  -  not found in the database"
@@ -1,13 +1,34 @@
-from fastapi import APIRouter, Request
+from enum import Enum
+
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import JSONResponse
 
 from loguru import logger
 from typing import Optional, List
 from datetime import datetime
 
-from ..database.models import Message
-from ..database.utils import check_ObjectId, get_not_None_args
+from pymongo.errors import DuplicateKeyError
+
+from ..database.models import Message, BulkResult
+from ..database.utils import (
+    check_ObjectId,
+    get_not_None_args,
+    encode_cursor,
+    decode_cursor,
+    duplicate_message,
+)
 from ..database import records
+from ..settings import settings
+from .utils import (
+    BSON_RESPONSE,
+    changed_since,
+    conditional,
+    ids,
+    projection,
+    since,
+    trusted,
+    wants_bson,
+)
 
 
 router = APIRouter()
@@ -16,44 +37,177 @@ router = APIRouter()
 @router.get(
     "/records",
     summary="Get all records or filtered by query args",
+    description=(
+        "Records are returned page by page. Pass the X-Next-Cursor header of a page "
+        "as `cursor` to get the next one, page_number is kept for compatibility"
+    ),
     response_model=List[records.Record],
-    responses={404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}, **BSON_RESPONSE},
+    dependencies=[Depends(conditional("records"))],
 )
 async def get_records(
+    response: Response,
     fromdate: Optional[datetime] = None,
     todate: Optional[datetime] = None,
     room_name: Optional[str] = None,
     url: Optional[str] = None,
     page_number: int = 0,
+    page_size: int = Query(50, gt=0, le=500),
+    cursor: Optional[str] = None,
     with_keywords_only: bool = False,
     ignore_autorec: bool = False,
     camera_ip: Optional[str] = None,
+    projection: Optional[dict] = Depends(projection),
+    raw: bool = Depends(wants_bson),
+    since: Optional[int] = Depends(since),
+    ids: Optional[list] = Depends(ids),
 ):
+    if since is not None:
+        return await changed_since(records.records_collection, "records", since, response)
+
+    if ids is not None:
+        records_found = await records.get_many(ids, projection, raw=raw)
+        return trusted(records_found, response, partial=bool(projection), raw=raw)
+
+    after = None
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        if not after or not isinstance(after.get("id"), str) or not check_ObjectId(after["id"]):
+            message = "Cursor is written in the wrong format"
+            return JSONResponse(status_code=400, content={"message": message})
+        after["id"] = check_ObjectId(after["id"])
+
     if all(p is None for p in [fromdate, todate, room_name, url, camera_ip]):
-        return await records.get_all(
+        # Dates are compared in the query, anything but a string could carry operators
+        if after and not isinstance(after.get("date"), str):
+            message = "Cursor is written in the wrong format"
+            return JSONResponse(status_code=400, content={"message": message})
+
+        records_found = await records.get_all(
             page_number,
+            page_size,
             with_keywords_only=with_keywords_only,
             ignore_autorec=ignore_autorec,
+            after=after,
+            # The next page cursor is made of the date
+            projection={**projection, "date": 1} if projection else None,
+            raw=raw,
+        )
+    else:
+        filter_args = get_not_None_args(
+            {
+                "fromdate": fromdate,
+                "todate": todate,
+                "room_name": room_name,
+                "url": url,
+                "camera_ip": camera_ip,
+            }
+        )
+
+        records_found = await records.sort_many(
+            filter_args,
+            page_number,
+            page_size,
+            with_keywords_only=with_keywords_only,
+            ignore_autorec=ignore_autorec,
+            after=after,
+            projection=projection,
+            raw=raw,
+        )
+        if not records_found:
+            message = "Records not found"
+            logger.info(message)
+            return JSONResponse(status_code=404, content={"message": message})
+
+    if len(records_found) == page_size:
+        last = records_found[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            {"date": last.get("date"), "id": str(last["_id"]) if raw else last["id"]}
         )
 
-    all_args = locals()
-    filter_args = get_not_None_args(all_args)
-    filter_args.pop("page_number")
-    filter_args.pop("with_keywords_only")
-    filter_args.pop("ignore_autorec")
-
-    records_found = await records.sort_many(
-        filter_args,
-        page_number,
-        with_keywords_only=with_keywords_only,
-        ignore_autorec=ignore_autorec,
+    return trusted(records_found, response, partial=bool(projection), raw=raw)
+
+
+@router.get(
+    "/records/search",
+    summary="Search records by keywords",
+    description=(
+        "Records whose keywords contain words of the text, the most relevant first, "
+        "relevance is returned as score. Words are matched by their stems, a phrase is "
+        "searched for in quotes and a word is excluded with a minus. Filters are the same "
+        "as in GET /records"
+    ),
+    response_model=List[records.Record],
+    responses={404: {"model": Message}},
+    dependencies=[Depends(conditional("records"))],
+)
+async def search_records(
+    response: Response,
+    text: str = Query(..., min_length=1, description="Words to search for"),
+    fromdate: Optional[datetime] = None,
+    todate: Optional[datetime] = None,
+    room_name: Optional[str] = None,
+    camera_ip: Optional[str] = None,
+    page_number: int = 0,
+    page_size: int = Query(50, gt=0, le=500),
+    projection: Optional[dict] = Depends(projection),
+):
+    filter_args = get_not_None_args(
+        {
+            "fromdate": fromdate,
+            "todate": todate,
+            "room_name": room_name,
+            "camera_ip": camera_ip,
+        }
     )
-    if records_found:
-        return records_found
 
-    message = "Records not found"
-    logger.info(message)
-    return JSONResponse(status_code=404, content={"message": message})
+    records_found = await records.search(text, filter_args, page_number, page_size, projection)
+    if not records_found:
+        message = "Records not found"
+        logger.info(message)
+        return JSONResponse(status_code=404, content={"message": message})
+
+    return trusted(records_found, response, partial=bool(projection))
+
+
+class StatsGroup(str, Enum):
+    room = "room"
+    type = "type"
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+@router.get(
+    "/records/stats",
+    summary="Get records statistics",
+    description=(
+        "Number of records, total recorded hours and share of records with keywords, "
+        "grouped by room, type of record or day/week/month of the record start. "
+        "Filters are the same as in GET /records"
+    ),
+    response_model=List[records.RecordStats],
+    dependencies=[Depends(conditional("records"))],
+)
+async def get_records_stats(
+    group_by: StatsGroup = StatsGroup.room,
+    fromdate: Optional[datetime] = None,
+    todate: Optional[datetime] = None,
+    room_name: Optional[str] = None,
+    type: Optional[str] = None,
+    camera_ip: Optional[str] = None,
+):
+    filter_args = get_not_None_args(
+        {
+            "fromdate": fromdate,
+            "todate": todate,
+            "room_name": room_name,
+            "type": type,
+            "camera_ip": camera_ip,
+        }
+    )
+
+    return await records.stats(group_by.value, filter_args)
 
 
 @router.get(
@@ -62,6 +216,7 @@ async def get_records(
     description="Get a record specified by it's ObjectId",
     response_model=records.Record,
     responses={400: {"model": Message}, 404: {"model": Message}},
+    dependencies=[Depends(conditional("records"))],
 )
 async def get_record_by_id(record_id: str):
     # Check if ObjectId is in the right format
@@ -90,37 +245,45 @@ async def get_record_by_id(record_id: str):
     responses={409: {"model": Message}},
 )
 async def add_record(record: records.Record, request: Request):
-    if (
-        await records.get_by_url(record.url)
-        and record.url is not None
-        and record.url != ""
-    ):
-        message = f"Record with url: {record.url}  -  already exists in the database"
+    new_record = await request.json()
+
+    if record.type == "Autorecord" and await records.overlaps(new_record):
+        message = (
+            "Record that was done in the same room, by the same camera, "
+            "at the same time already exists in the database"
+        )
         logger.info(message)
         return JSONResponse(status_code=409, content={"message": message})
 
-    if record.type == "Autorecord":
-        str_from_date = f"{record.date} {record.start_time[:5]}"
-        str_to_date = f"{record.date} {record.end_time[:5]}"
-
-        from_date = datetime.strptime(str_from_date, "%Y-%m-%d %H:%M")
-        to_date = datetime.strptime(str_to_date, "%Y-%m-%d %H:%M")
-
-        filter_args = {
-            "room_name": record.room_name,
-            "fromdate": from_date,
-            "todate": to_date,
-            "camera_ip": record.camera_ip,
-        }
+    # Non-empty url is unique in the database
+    try:
+        return await records.add(new_record)
+    except DuplicateKeyError as e:
+        message = duplicate_message("Record", e.details)
+        logger.info(message)
+        return JSONResponse(status_code=409, content={"message": message})
 
-        records_found = await records.sort_many(filter_args, page_number=0)
 
-        if records_found:
-            message = "Record that was done in the same room, by the same camera, at the same time already exists in the database"
-            logger.info(message)
-            return JSONResponse(status_code=409, content={"message": message})
+@router.post(
+    "/records/bulk",
+    summary="Create many records",
+    description=(
+        "Create records in a single insert. Records with a url that is already taken and "
+        "Autorecords done in the same room, by the same camera, at the same time as another "
+        "record are reported as duplicates. Results are returned in the order of the request"
+    ),
+    response_model=List[BulkResult],
+    responses={400: {"model": Message}},
+)
+async def add_records(records_list: List[records.Record], request: Request):
+    if len(records_list) > settings.bulk_limit:
+        message = f"At most {settings.bulk_limit} records can be created at once"
+        logger.info(message)
+        return JSONResponse(status_code=400, content={"message": message})
 
-    return await records.add(await request.json())
+    results = await records.add_many(await request.json())
+    logger.info(f"Bulk insert of {len(results)} records")
+    return results
 
 
 @router.delete(
@@ -155,7 +318,7 @@ async def delete_record(record_id: str):
     summary="Patch record",
     description="Updates additional attributes of record specified by it's ObjectId",
     response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def update_record(record_id: str, new_values: dict, request: Request):
     # Check if ObjectId is in the right format
@@ -171,7 +334,13 @@ async def update_record(record_id: str, new_values: dict, request: Request):
         return JSONResponse(status_code=400, content={"message": message})
 
     if await records.get_by_id(id):
-        await records.patch(id, new_values)
+        try:
+            await records.patch(id, new_values)
+        except DuplicateKeyError as e:
+            message = duplicate_message("Record", e.details)
+            logger.info(message)
+            return JSONResponse(status_code=409, content={"message": message})
+
         message = f"Record: {record_id} patched"
         logger.info(message)
         return JSONResponse(status_code=200, content={"message": message})
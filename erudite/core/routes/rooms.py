@@ -1,19 +1,36 @@
-from fastapi import APIRouter, Request
+from enum import Enum
+
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import JSONResponse
 
 from loguru import logger
 from typing import Optional, List
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
 
 from ..database.models import (
     Message,
 )
-from ..database import rooms, equipment
-from ..database.utils import check_ObjectId, get_not_None_args
+from ..database import rooms, equipment, lessons, schedule
+from ..database.utils import check_ObjectId, get_not_None_args, duplicate_message, local_time
+from .utils import changed_since, conditional, ids, projection, since, trusted
 
 
 router = APIRouter()
 
 
+class Expand(str, Enum):
+    equipment = "equipment"
+
+
+EXPAND_DESCRIPTION = (
+    "With equipment, every room gets an `equipment` list of its equipment, read in the "
+    "same query. Such rooms are not validated against the response model. Can't be used "
+    "with `since` or `ids`"
+)
+
+
 @router.get(
     "/rooms",
     summary="Get all rooms",
@@ -21,9 +38,11 @@ router = APIRouter()
         "Get a list of all rooms in the database or a room by any of it's atributes, if provided"
     ),
     response_model=List[rooms.Room],
-    responses={404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}},
+    dependencies=[Depends(conditional("rooms", expandable=["equipment"]))],
 )
 async def list_rooms(
+    response: Response,
     ruz_type_of_auditorium_oid: Optional[int] = None,
     ruz_amount: Optional[int] = None,
     ruz_auditorium_oid: Optional[int] = None,
@@ -31,7 +50,21 @@ async def list_rooms(
     ruz_building_gid: Optional[int] = None,
     ruz_number: Optional[str] = None,
     ruz_type_of_auditorium: Optional[str] = None,
+    projection: Optional[dict] = Depends(projection),
+    since: Optional[int] = Depends(since),
+    ids: Optional[list] = Depends(ids),
+    expand: Optional[Expand] = Query(None, description=EXPAND_DESCRIPTION),
 ):
+    if expand and (since is not None or ids is not None):
+        message = "expand can't be used with since or ids"
+        return JSONResponse(status_code=400, content={"message": message})
+
+    if since is not None:
+        return await changed_since(rooms.rooms_collection, "rooms", since, response)
+
+    if ids is not None:
+        return trusted(await rooms.get_many(ids, projection), response, partial=bool(projection))
+
     if all(
         p is None
         for p in [
@@ -44,15 +77,22 @@ async def list_rooms(
         ]
     ):
         logger.info("All rooms returned")
-        return await rooms.get_all()
+        if expand:
+            return trusted(await rooms.get_with_equipment({}, projection), response, partial=True)
+        return trusted(await rooms.get_all(projection), response, partial=bool(projection))
 
     all_args = locals()
+    del all_args["response"], all_args["projection"], all_args["since"], all_args["ids"]
+    del all_args["expand"]
     filter_args = get_not_None_args(all_args)
 
-    room_found = await rooms.sort_many(filter_args)
+    if expand:
+        room_found = await rooms.get_with_equipment(filter_args, projection)
+    else:
+        room_found = await rooms.sort_many(filter_args, projection)
     if room_found:
         logger.info("Room found")
-        return room_found
+        return trusted(room_found, response, partial=bool(projection or expand))
 
     message = "Rooms are not found"
     logger.info(message)
@@ -65,8 +105,13 @@ async def list_rooms(
     description="Get a room specified by it's ObjectId",
     response_model=rooms.Room,
     responses={400: {"model": Message}, 404: {"model": Message}},
+    dependencies=[Depends(conditional("rooms", expandable=["equipment"]))],
 )
-async def find_room(room_id: str):
+async def find_room(
+    room_id: str,
+    response: Response,
+    expand: Optional[Expand] = Query(None, description=EXPAND_DESCRIPTION),
+):
     # Check if ObjectId is in the right format
     id = check_ObjectId(room_id)
 
@@ -75,10 +120,15 @@ async def find_room(room_id: str):
         return JSONResponse(status_code=400, content={"message": message})
 
     # Check if room with specified ObjectId is in the database
-    room = await rooms.get(id)
+    if expand:
+        found = await rooms.get_with_equipment({"_id": id})
+        room = found[0] if found else None
+    else:
+        room = await rooms.get(id)
+
     if room:
         logger.info(f"Room {room_id}: {room}")
-        return room
+        return trusted(room, response, partial=True) if expand else room
 
     message = "This room is not found"
     logger.info(message)
@@ -91,15 +141,17 @@ async def find_room(room_id: str):
     description="Create a room specified by it's ObjectId",
     response_model=rooms.Room,
     status_code=201,
+    responses={409: {"model": Message}},
 )
 async def create_room(room: rooms.Room, request: Request):
-    # Check if room with specified ObjectId is in the database
-    if await rooms.get_by_ruz_id(room.ruz_auditorium_oid):
-        message = f"Room with ruz_id: '{room.ruz_auditorium_oid}' already exists in the database"
+    # Room ruz id is unique in the database
+    try:
+        new_room = await rooms.add(await request.json())
+    except DuplicateKeyError as e:
+        message = duplicate_message("Room", e.details)
         logger.info(message)
         return JSONResponse(status_code=409, content={"message": message})
 
-    new_room = await rooms.add(await request.json())
     logger.info(
         f"Room with ruz_id: {room.ruz_auditorium_oid}  -  added to the database"
     )
@@ -138,7 +190,7 @@ async def delete_room(room_id: str):
     summary="Patch room",
     description="Updates additional atributes of room specified by it's ObjectId",
     response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def patch_room(room_id: str, new_values: dict, request: Request):
     # Check if ObjectId is in the right format
@@ -154,7 +206,13 @@ async def patch_room(room_id: str, new_values: dict, request: Request):
         return JSONResponse(status_code=400, content={"message": message})
 
     if await rooms.get(id):
-        await rooms.patch(id, new_values)
+        try:
+            await rooms.patch(id, new_values)
+        except DuplicateKeyError as e:
+            message = duplicate_message("Room", e.details)
+            logger.info(message)
+            return JSONResponse(status_code=409, content={"message": message})
+
         message = f"Room: {room_id} patched"
         logger.info(message)
         return {"message": message}
@@ -168,8 +226,8 @@ async def patch_room(room_id: str, new_values: dict, request: Request):
     "/rooms/{room_id}",
     summary="Updates room",
     description="Deletes old atributes of room specified by it's ObjectId and puts in new ones",
-    response_model=Message,
-    responses={400: {"model": Message}, 404: {"model": Message}},
+    response_model=rooms.Room,
+    responses={400: {"model": Message}, 404: {"model": Message}, 409: {"model": Message}},
 )
 async def update_room(room_id: str, room: rooms.Room, request: Request):
     # Check if ObjectId is in the right format
@@ -184,13 +242,16 @@ async def update_room(room_id: str, room: rooms.Room, request: Request):
         message = "Please fill the request body"
         return JSONResponse(status_code=400, content={"message": message})
 
-    if await rooms.get(id):
-        await rooms.remove(id)
-        await rooms.add_empty(id)
-        await rooms.put(id, new_values)
-        message = f"Room: {room_id} updated"
+    try:
+        updated_room = await rooms.put(id, new_values)
+    except DuplicateKeyError as e:
+        message = duplicate_message("Room", e.details)
         logger.info(message)
-        return {"message": message}
+        return JSONResponse(status_code=409, content={"message": message})
+
+    if updated_room:
+        logger.info(f"Room: {room_id} updated")
+        return updated_room
     # Check if room with specified ObjectId is in the database
     else:
         message = f"Room: {room_id}  -  not found in the database"
@@ -204,8 +265,11 @@ async def update_room(room_id: str, room: rooms.Room, request: Request):
     description="Get a list of equipment from the room specified by it's ObjectId",
     response_model=List[equipment.Equipment],
     responses={400: {"model": Message}, 404: {"model": Message}},
+    dependencies=[Depends(conditional("rooms", "equipment"))],
 )
-async def list_room_equipments(room_id: str):
+async def list_room_equipments(
+    room_id: str, response: Response, projection: Optional[dict] = Depends(projection)
+):
     # Check if ObjectId is in the right format
     id = check_ObjectId(room_id)
 
@@ -215,11 +279,79 @@ async def list_room_equipments(room_id: str):
 
     room = await rooms.get(id)
     if room:
-        data = await equipment.sort(id)
+        data = await equipment.sort(id, projection)
         logger.info(data)
-        return data
+        return trusted(data, response, partial=bool(projection))
     # Check if equipment with specified room_id is in the database
     else:
         message = "This room is not found"
         logger.info(message)
         return JSONResponse(status_code=404, content={"message": message})
+
+
+@router.get(
+    "/rooms/{room_id}/current",
+    summary="Get the current lesson in the room",
+    description=(
+        "Get a lesson that is held in the room specified by it's ObjectId at the moment, "
+        "or at the time given in `at`"
+    ),
+    response_model=lessons.Lesson,
+    responses={400: {"model": Message}, 404: {"model": Message}},
+)
+async def get_current_lesson(room_id: str, at: Optional[datetime] = None):
+    # Check if ObjectId is in the right format
+    id = check_ObjectId(room_id)
+
+    if not id:
+        message = "ObjectId is written in the wrong format"
+        return JSONResponse(status_code=400, content={"message": message})
+
+    room = await rooms.get(id)
+    if not room:
+        message = "This room is not found"
+        logger.info(message)
+        return JSONResponse(status_code=404, content={"message": message})
+
+    at = local_time(at)
+    lesson = await schedule.current_lesson(room["ruz_auditorium_oid"], at)
+    if lesson:
+        return lesson
+
+    message = f"There is no lesson in the room {room_id} at {at}"
+    logger.info(message)
+    return JSONResponse(status_code=404, content={"message": message})
+
+
+@router.get(
+    "/rooms/{room_id}/next",
+    summary="Get the next lesson in the room",
+    description=(
+        "Get the first lesson in the room specified by it's ObjectId that starts after "
+        "the moment, or after the time given in `at`"
+    ),
+    response_model=lessons.Lesson,
+    responses={400: {"model": Message}, 404: {"model": Message}},
+)
+async def get_next_lesson(room_id: str, at: Optional[datetime] = None):
+    # Check if ObjectId is in the right format
+    id = check_ObjectId(room_id)
+
+    if not id:
+        message = "ObjectId is written in the wrong format"
+        return JSONResponse(status_code=400, content={"message": message})
+
+    room = await rooms.get(id)
+    if not room:
+        message = "This room is not found"
+        logger.info(message)
+        return JSONResponse(status_code=404, content={"message": message})
+
+    at = local_time(at)
+    lesson = await schedule.next_lesson(room["ruz_auditorium_oid"], at)
+    if lesson:
+        return lesson
+
+    message = f"There are no lessons in the room {room_id} after {at}"
+    logger.info(message)
+    return JSONResponse(status_code=404, content={"message": message})
@@ -0,0 +1,182 @@
+""" Вспомогательные функции роутеров """
+
+import hashlib
+from typing import Any, Callable, List, Optional, Sequence
+
+import orjson
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from fastapi import HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+
+from ..database import revisions, versions
+from ..database.utils import check_ObjectId
+from ..settings import settings
+
+
+def conditional(*collections: str, expandable: Sequence[str] = ()) -> Callable:
+    """ Dependency of GET endpoints that read the collections, and the
+    `expandable` ones only when they are asked for with `expand`.
+
+    The ETag is made of the collections versions, the request URL and the media
+    type asked for, so it is known before anything is read from mongo. If the
+    client already has it, the endpoint is not called and 304 Not Modified is
+    returned.
+
+    Versions only see writes of other workers and other mongo clients with
+    change streams on, without them no ETag is sent """
+
+    def dependency(request: Request, response: Response):
+        if not settings.change_streams:
+            return
+
+        query = sorted(request.query_params.multi_items())
+        url = hashlib.blake2b(
+            f"{request.url.path}?{query} {wants_bson(request)}".encode(), digest_size=8
+        )
+        expanded = [
+            collection
+            for collection in expandable
+            if collection in request.query_params.getlist("expand")
+        ]
+        etag = f'W/"{versions.tag(*collections, *expanded)}-{url.hexdigest()}"'
+
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+
+    return dependency
+
+
+def wants_bson(request: Request) -> bool:
+    """ Dependency of list endpoints that can send raw BSON, asked for with
+    the Accept: application/bson header """
+
+    return "application/bson" in request.headers.get("accept", "")
+
+
+class BSONResponse(Response):
+    """ RawBSONDocuments sent as they came from mongo, one after another """
+
+    media_type = "application/bson"
+
+    def render(self, content: List[RawBSONDocument]) -> bytes:
+        return b"".join(document.raw for document in content)
+
+
+class ORJSONResponse(JSONResponse):
+    """ JSON response encoded by orjson, values it doesn't know (ObjectId) become strings """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str)
+
+
+def projection(
+    fields: Optional[str] = Query(
+        None,
+        description=(
+            "Comma separated fields to return, id is always returned. Documents "
+            "with only some of the fields are not validated against the response model"
+        ),
+        example="name,ip,rtsp_main",
+    )
+) -> Optional[dict]:
+    """ Dependency of list endpoints: mongo projection of the requested fields """
+
+    if not fields:
+        return None
+
+    names = sorted({name.strip() for name in fields.split(",")} - {"", "id"})
+    for name in names:
+        if name.startswith("$") or any(other.startswith(f"{name}.") for other in names):
+            raise HTTPException(status_code=400, detail=f"Field '{name}' can't be returned")
+
+    # Only _id is left if nothing but id was asked for
+    return {name: 1 for name in names} or {"_id": 1}
+
+
+def ids(
+    ids: Optional[str] = Query(
+        None,
+        description=(
+            "Comma separated ObjectIds to get in one request, at most `IDS_LIMIT` of them. "
+            "Documents are returned in the same order, ids that are not found are skipped. "
+            "Other filters are not applied"
+        ),
+        example="5fd9c1c3d0e0a57a1b5d1e2f,5fd9c1c3d0e0a57a1b5d1e30",
+    )
+) -> Optional[List[ObjectId]]:
+    """ Dependency of list endpoints: ObjectIds to look up with a single query """
+
+    if ids is None:
+        return None
+
+    object_ids = []
+    for id in filter(None, (id.strip() for id in ids.split(","))):
+        object_id = check_ObjectId(id)
+        if not object_id:
+            raise HTTPException(status_code=400, detail=f"Id '{id}' is written in the wrong format")
+        object_ids.append(object_id)
+
+    if len(object_ids) > settings.ids_limit:
+        raise HTTPException(
+            status_code=400, detail=f"At most {settings.ids_limit} ids can be asked for at once"
+        )
+
+    return object_ids
+
+
+def since(
+    since: Optional[int] = Query(
+        None,
+        ge=0,
+        description=(
+            "Return only the changes made after this revision: written documents, "
+            "ids of deleted ones and the revision to pass next time. Other filters "
+            "and fields are not applied, start from 0 to get every document"
+        ),
+    )
+) -> Optional[int]:
+    """ Dependency of list endpoints: revision to pull the changes after """
+
+    return since
+
+
+async def changed_since(collection, name: str, since: int, response: Response) -> Response:
+    """ Return the changes of the collection made after the `since` revision """
+
+    changes = await revisions.changed_since(collection, name, since)
+    return ORJSONResponse(changes, headers=dict(response.headers))
+
+
+def trusted(content: Any, response: Response, partial: bool = False, raw: bool = False) -> Any:
+    """ Return documents of a list endpoint.
+
+    With settings.trusted_responses, or if documents are `partial` projections,
+    they are sent as read from mongo, so FastAPI neither validates them against
+    the response model nor runs jsonable_encoder. The model still documents the
+    endpoint. `raw` documents are RawBSONDocuments and are sent as BSON. Headers
+    set on `response` by the endpoint and its dependencies are copied, as a
+    returned response drops them """
+
+    if raw:
+        return BSONResponse(content, headers=dict(response.headers))
+
+    if not (settings.trusted_responses or partial):
+        return content
+
+    return ORJSONResponse(content, headers=dict(response.headers))
+
+
+# OpenAPI responses of list endpoints that send raw BSON
+BSON_RESPONSE = {
+    200: {
+        "content": {"application/bson": {}},
+        "description": (
+            "With Accept: application/bson, documents are sent as stored: "
+            "concatenated BSON documents with ObjectId _id"
+        ),
+    }
+}
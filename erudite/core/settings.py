@@ -27,6 +27,56 @@ class Settings(BaseSettings):
     mongo_url: str = Field(..., env="MONGO_DB_URL")
     mongo_db_name: str = Field(..., env="MONGO_DB_NAME")
 
+    psql_pool_min_size: int = Field(env="PSQL_POOL_MIN_SIZE", default=1)
+    psql_pool_max_size: int = Field(env="PSQL_POOL_MAX_SIZE", default=10)
+
+    # Validated API keys are cached in-process for `auth_cache_ttl` seconds.
+    # NVR may drop them earlier with NOTIFY <auth_notify_channel>, '<api_key>'
+    # (an empty payload drops the whole cache)
+    auth_cache_ttl: int = Field(env="AUTH_CACHE_TTL", default=300)
+    auth_cache_size: int = Field(env="AUTH_CACHE_SIZE", default=1024)
+    auth_notify_channel: str = Field(env="AUTH_NOTIFY_CHANNEL", default="users_changed")
+
+    # Rooms and equipment lookups are cached for `catalog_cache_ttl` seconds.
+    # Writes drop the cache of the worker that made them, with change_streams on
+    # (needs a replica set) writes made by other workers drop it as well
+    catalog_cache_ttl: int = Field(env="CATALOG_CACHE_TTL", default=60)
+    catalog_cache_size: int = Field(env="CATALOG_CACHE_SIZE", default=1024)
+    change_streams: bool = Field(env="CHANGE_STREAMS", default=False)
+
+    # Change feed: events queued per client before it is cut off as too slow,
+    # and seconds between keepalive comments of an idle feed
+    changes_queue_size: int = Field(env="CHANGES_QUEUE_SIZE", default=1000)
+    changes_keepalive: int = Field(env="CHANGES_KEEPALIVE", default=15)
+
+    # Records statistics are cached the same way for `stats_cache_ttl` seconds
+    stats_cache_ttl: int = Field(env="STATS_CACHE_TTL", default=300)
+    stats_cache_size: int = Field(env="STATS_CACHE_SIZE", default=256)
+
+    # In-memory schedule of the rooms is kept up to date with lessons writes and
+    # reloaded after `schedule_ttl` seconds
+    schedule_ttl: int = Field(env="SCHEDULE_TTL", default=60)
+    # Lessons are stored as naive local time of this timezone
+    timezone: str = Field(env="TIMEZONE", default="Europe/Moscow")
+
+    # Documents fetched from mongo per round trip by export endpoints
+    export_batch_size: int = Field(env="EXPORT_BATCH_SIZE", default=1000)
+
+    # Ids that can be asked for in one request (`?ids=`)
+    ids_limit: int = Field(env="IDS_LIMIT", default=500)
+    # Records that can be created in one bulk request
+    bulk_limit: int = Field(env="BULK_LIMIT", default=1000)
+
+    # Changes sent per incremental sync pull (`?since=`)
+    sync_batch_size: int = Field(env="SYNC_BATCH_SIZE", default=1000)
+    # Seconds a change waits before it is sent, writes have to finish in that
+    # time after their revision is taken
+    revision_lag: float = Field(env="REVISION_LAG", default=5)
+
+    # List endpoints send documents as they are stored, encoded with orjson,
+    # without validating them against the response model first
+    trusted_responses: bool = Field(env="TRUSTED_RESPONSES", default=False)
+
     testing: typing.Optional[bool] = Field(env="TESTING", default=False)
     dev: typing.Optional[bool] = Field(env="DEV", default=False)
 
@@ -1,4 +1,3 @@
-from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi.openapi.utils import get_openapi
 
 from prometheus_fastapi_instrumentator import Instrumentator
@@ -15,23 +14,39 @@ def create_app():
         app = FastAPI()
     else:
         app = FastAPI(root_path="/api/erudite")
-        from core.middleware import authorization
+        from core.middleware import AuthorizationMiddleware, db_startup, db_shutdown
 
-        app.add_middleware(BaseHTTPMiddleware, dispatch=authorization)
+        app.add_middleware(AuthorizationMiddleware)
+        app.add_event_handler("startup", db_startup)
+        app.add_event_handler("shutdown", db_shutdown)
 
     Instrumentator().instrument(app).expose(app)
 
+    from core.database.indexes import ensure_indexes
+
+    app.add_event_handler("startup", ensure_indexes)
+
+    if settings.change_streams:
+        from core.database import changes
+
+        app.add_event_handler("startup", changes.start)
+        app.add_event_handler("shutdown", changes.stop)
+
     from core.routes.rooms import router as room_router
     from core.routes.equipment import router as equipment_router
     from core.routes.disciplines import router as discipline_router
     from core.routes.lessons import router as lesson_router
     from core.routes.records import router as record_router
+    from core.routes.export import router as export_router
+    from core.routes.changes import router as changes_router
 
     app.include_router(room_router, tags=["rooms"])
     app.include_router(equipment_router, tags=["equipment"])
     app.include_router(discipline_router, tags=["disciplines"])
     app.include_router(lesson_router, tags=["lessons"])
     app.include_router(record_router, tags=["records"])
+    app.include_router(export_router, tags=["export"])
+    app.include_router(changes_router, tags=["changes"])
 
     return app
 
@@ -0,0 +1,131 @@
+import asyncio
+
+from core import cache
+from core.cache import SingleFlight, TTLCache, cached, single_flight
+
+
+def test_ttl_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+
+    ttl_cache = TTLCache(maxsize=2, ttl=10)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+
+    # "b" is the least recently used
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is None
+    assert ttl_cache.get("a") == 1
+
+    now[0] += 10
+    assert ttl_cache.get("a") is None
+    assert len(ttl_cache) == 1
+    assert (ttl_cache.hits, ttl_cache.misses) == (2, 2)
+
+
+def test_cached_keeps_results_until_cleared():
+    ttl_cache = TTLCache()
+    calls = []
+
+    @cached(ttl_cache)
+    async def get(key, projection=None):
+        calls.append(key)
+        return {"key": key} if key else None
+
+    async def main():
+        await get(1, {"a": 1})
+        await get(1, {"a": 1})
+        await get(0)
+        await get(0)
+        ttl_cache.clear()
+        await get(1, {"a": 1})
+
+    asyncio.run(main())
+
+    # None is not cached
+    assert calls == [1, 0, 0, 1]
+
+
+def test_cached_drops_results_read_before_a_write():
+    ttl_cache = TTLCache()
+
+    @cached(ttl_cache)
+    async def get(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        call = asyncio.ensure_future(get(1))
+        await asyncio.sleep(0)
+        ttl_cache.clear()
+        await call
+
+    asyncio.run(main())
+
+    assert len(ttl_cache) == 0
+
+
+def test_single_flight_shares_calls_with_the_same_arguments():
+    flights = SingleFlight()
+    calls = []
+
+    @single_flight(flights)
+    async def get(key, projection=None):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return [key]
+
+    async def main():
+        return await asyncio.gather(get(1), get(1), get(2), get(1, projection={"a": 1}))
+
+    results = asyncio.run(main())
+
+    assert results == [[1], [1], [2], [1]]
+    assert results[0] is results[1]
+    assert calls == [1, 2, 1]
+    assert (flights.hits, flights.misses) == (1, 3)
+    assert len(flights) == 0
+
+
+def test_single_flight_survives_a_cancelled_caller():
+    flights = SingleFlight()
+
+    @single_flight(flights)
+    async def get(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    async def main():
+        first = asyncio.ensure_future(get(1))
+        second = asyncio.ensure_future(get(1))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == 1
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+def test_single_flight_clear_starts_a_new_call():
+    flights = SingleFlight()
+    calls = []
+
+    @single_flight(flights)
+    async def get(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        before = asyncio.ensure_future(get(1))
+        await asyncio.sleep(0)
+        # A write between the callers
+        flights.clear()
+        after = asyncio.ensure_future(get(1))
+
+        return await before, await after
+
+    assert asyncio.run(main()) == (2, 2)
+    assert calls == [1, 1]
@@ -0,0 +1,90 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from core.database import changes, versions
+
+
+class Stream:
+    def __init__(self, events):
+        self.events = events
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.events:
+            raise asyncio.CancelledError
+        event = self.events.pop(0)
+        if isinstance(event, Exception):
+            raise event
+        self.resume_token = event["_id"]
+        return event
+
+
+class Database:
+    """ Change streams that replay the given events, one list per stream """
+
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.resume_tokens = []
+
+    def watch(self, pipeline, full_document, resume_after):
+        self.resume_tokens.append(resume_after)
+        return Stream(self.streams.pop(0))
+
+
+def event(token):
+    return {"_id": token, "ns": {"coll": "rooms"}}
+
+
+def run_watch(monkeypatch, database):
+    monkeypatch.setattr(changes, "db", database)
+
+    async def sleep(seconds):
+        pass
+
+    monkeypatch.setattr(changes.asyncio, "sleep", sleep)
+    try:
+        asyncio.run(changes.watch())
+    except asyncio.CancelledError:
+        pass
+
+
+def test_watch_resumes_after_network_errors(monkeypatch):
+    database = Database([event("a"), AutoReconnect("down")], [event("b")])
+    run_watch(monkeypatch, database)
+
+    assert database.resume_tokens == [None, "a"]
+
+
+def test_watch_starts_over_when_the_history_is_lost(monkeypatch):
+    lost = OperationFailure("history lost", code=286)
+    database = Database([event("a"), lost], [event("b")])
+
+    bumps = versions.counters["records"]
+    run_watch(monkeypatch, database)
+
+    assert database.resume_tokens == [None, None]
+    # Every start drops what other workers may have changed before it
+    assert versions.counters["records"] == bumps + 2
+
+
+def test_failing_listener_does_not_stop_the_stream(monkeypatch):
+    seen = []
+
+    def failing(change):
+        raise ValueError("listener bug")
+
+    monkeypatch.setitem(changes.listeners, "rooms", [failing, seen.append])
+    database = Database([event("a"), event("b")])
+    run_watch(monkeypatch, database)
+
+    assert [change["_id"] for change in seen if change] == ["a", "b"]
@@ -0,0 +1,67 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from core.database import lessons
+
+
+class Lessons:
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+        self.requests = []
+
+    def with_options(self, codec_options):
+        return self
+
+    async def bulk_write(self, requests, ordered):
+        self.requests = requests
+        if self.error:
+            raise BulkWriteError(self.error)
+
+        class Result:
+            bulk_api_result = self.result
+
+        return Result()
+
+
+def lesson(oid):
+    return {"ruz_lesson_oid": oid, "date": "2020-12-15", "start_time": "09:30", "end_time": "10:50"}
+
+
+def upsert_many(monkeypatch, collection, count, ordered=False):
+    monkeypatch.setattr(lessons, "lessons_collection", collection)
+    monkeypatch.setattr(lessons, "listeners", [])
+
+    return asyncio.run(lessons.upsert_many([lesson(oid) for oid in range(count)], ordered=ordered))
+
+
+def test_upsert_statuses(monkeypatch):
+    collection = Lessons(result={"writeErrors": [], "upserted": [{"index": 1, "_id": "b"}]})
+
+    assert upsert_many(monkeypatch, collection, 2) == [
+        {"status": "updated"},
+        {"status": "created", "id": "b"},
+    ]
+
+
+def test_ordered_upsert_skips_lessons_after_an_error(monkeypatch):
+    error = {
+        "writeErrors": [{"index": 1, "errmsg": "failed"}],
+        "upserted": [{"index": 0, "_id": "a"}],
+    }
+
+    assert upsert_many(monkeypatch, Lessons(error=error), 4, ordered=True) == [
+        {"status": "created", "id": "a"},
+        {"status": "error", "message": "failed"},
+        {"status": "skipped"},
+        {"status": "skipped"},
+    ]
+
+
+def test_upsert_keeps_its_revision():
+    pipeline = lessons._upsert_pipeline({"revision": 1, "a": 2}, 5)
+    unchanged, stamped = [stage["$set"] for stage in pipeline]
+
+    assert stamped == {"a": {"$literal": 2}}
+    assert unchanged["revision"]["$cond"][1:] == ["$revision", 5]
+    assert "$revision" not in str(unchanged["revision"]["$cond"][0])
@@ -0,0 +1,81 @@
+import asyncio
+
+from bson.objectid import ObjectId
+
+from core.database import records
+
+
+class Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class Records:
+    """ Stored records, queries by url are answered, others get every record """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        if "url" in query:
+            urls = query["url"]["$in"]
+            return Cursor([d for d in self.documents if d.get("url") in urls])
+        return Cursor(self.documents)
+
+    async def insert_many(self, documents, ordered):
+        for document in documents:
+            document["_id"] = ObjectId()
+        self.documents += documents
+
+
+def record(url="", start_time="10:00", end_time="11:00", type="Offline", camera_ip="1"):
+    return {
+        "room_name": "504",
+        "date": "2020-12-15",
+        "start_time": start_time,
+        "end_time": end_time,
+        "url": url,
+        "type": type,
+        "camera_ip": camera_ip,
+    }
+
+
+def add_many(monkeypatch, stored, batch):
+    collection = Records([records.with_datetimes(document) for document in stored])
+    monkeypatch.setattr(records, "records_collection", collection)
+
+    return [status["status"] for status in asyncio.run(records.add_many(batch))]
+
+
+def test_taken_urls_are_duplicates(monkeypatch):
+    statuses = add_many(
+        monkeypatch,
+        [record("a")],
+        [record("a"), record("b"), record("b"), record(""), record("")],
+    )
+
+    assert statuses == ["duplicate", "created", "duplicate", "created", "created"]
+
+
+def test_overlapping_autorecords_are_duplicates(monkeypatch):
+    statuses = add_many(
+        monkeypatch,
+        [record(start_time="09:00", end_time="10:30")],
+        [
+            # Overlaps the stored record
+            record(type="Autorecord", start_time="10:00", end_time="11:00"),
+            # Other camera
+            record(type="Autorecord", start_time="10:00", end_time="11:00", camera_ip="2"),
+            # Starts as the stored one ends
+            record(start_time="10:30", end_time="12:00"),
+            # Overlaps the record before it in the batch
+            record(type="Autorecord", start_time="11:00", end_time="11:30"),
+            record(type="Autorecord", start_time="12:00", end_time="13:00"),
+        ],
+    )
+
+    assert statuses == ["duplicate", "created", "created", "duplicate", "created"]
@@ -0,0 +1,131 @@
+import asyncio
+
+from core.database import revisions
+from core.settings import settings
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        self.documents.sort(key=lambda document: document[key], reverse=direction < 0)
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    async def to_list(self, length):
+        return self.documents
+
+
+class FakeCollection:
+    """ Answers the queries of changed_since: equality, $gt and $lte """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    @staticmethod
+    def matches(document, query):
+        for field, condition in query.items():
+            value = document.get(field)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$gt" in condition and not value > condition["$gt"]:
+                return False
+            if "$lte" in condition and not value <= condition["$lte"]:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(d) for d in self.documents if self.matches(d, query)])
+
+
+def pull(monkeypatch, documents, tombstones, since, limit, committed=None):
+    def committed_revision():
+        if committed is not None:
+            return committed
+        return max(change["revision"] for change in documents + tombstones)
+
+    monkeypatch.setattr(revisions, "committed_revision", committed_revision)
+    monkeypatch.setattr(revisions, "tombstones_collection", FakeCollection(tombstones))
+
+    return asyncio.run(
+        revisions.changed_since(FakeCollection(documents), "rooms", since, limit=limit)
+    )
+
+
+DOCUMENTS = [
+    {"id": "a", "revision": 1},
+    {"id": "b", "revision": 2},
+    {"id": "c", "revision": 2},
+    {"id": "d", "revision": 2},
+    {"id": "e", "revision": 3},
+]
+TOMBSTONES = [
+    {"collection": "rooms", "document_id": "x", "revision": 2},
+    {"collection": "equipment", "document_id": "y", "revision": 2},
+]
+
+
+def test_pages_do_not_end_inside_a_revision(monkeypatch):
+    page = pull(monkeypatch, DOCUMENTS, TOMBSTONES, since=0, limit=2)
+
+    assert page["revision"] == 2
+    assert page["more"] is True
+    assert [document["id"] for document in page["documents"]] == ["a", "b", "c", "d"]
+    assert page["deleted"] == ["x"]
+
+    page = pull(monkeypatch, DOCUMENTS, TOMBSTONES, since=page["revision"], limit=2)
+
+    assert page["revision"] == 3
+    assert page["more"] is False
+    assert [document["id"] for document in page["documents"]] == ["e"]
+    assert page["deleted"] == []
+
+
+def test_every_change_is_pulled_once(monkeypatch):
+    seen, since, more = [], 0, True
+    while more:
+        page = pull(monkeypatch, DOCUMENTS, TOMBSTONES, since=since, limit=1)
+        seen += [document["id"] for document in page["documents"]] + page["deleted"]
+        since, more = page["revision"], page["more"]
+
+    assert sorted(seen) == ["a", "b", "c", "d", "e", "x"]
+
+
+def test_pull_stops_at_unfinished_writes(monkeypatch):
+    page = pull(monkeypatch, DOCUMENTS, TOMBSTONES, since=1, limit=10, committed=1)
+
+    assert page == {"revision": 1, "more": False, "documents": [], "deleted": []}
+
+
+def test_document_written_after_delete_is_not_deleted(monkeypatch):
+    tombstones = [{"collection": "rooms", "document_id": "e", "revision": 2}]
+    page = pull(monkeypatch, DOCUMENTS, tombstones, since=0, limit=10)
+
+    assert "e" in [document["id"] for document in page["documents"]]
+    assert page["deleted"] == []
+
+
+def test_revisions_grow_and_wait_for_the_lag(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(revisions.time, "time", lambda: now[0])
+    monkeypatch.setattr(revisions, "last_revision", 0)
+    monkeypatch.setattr(settings, "revision_lag", 5)
+
+    first = revisions.next_revision()
+    last = revisions.next_revision(3)
+    assert last == first + 3
+
+    # The clock going back does not take revisions back
+    now[0] -= 1
+    assert revisions.next_revision() == last + 1
+
+    now[0] += 5.5
+    assert revisions.committed_revision() < first
+    now[0] += 0.5
+    assert revisions.committed_revision() >= last + 1
@@ -0,0 +1,22 @@
+import pytest
+from fastapi import HTTPException
+
+from core.routes.utils import projection
+
+
+def test_projection_of_requested_fields():
+    assert projection(None) is None
+    assert projection("") is None
+    assert projection(" name, ip ,name,") == {"ip": 1, "name": 1}
+    assert projection("id,name") == {"name": 1}
+    # Only the id was asked for
+    assert projection("id") == {"_id": 1}
+    assert projection("room.name") == {"room.name": 1}
+
+
+@pytest.mark.parametrize("fields", ["$where", "name,$expr", "room,room.name"])
+def test_projection_rejects_fields_mongo_would_not_take(fields):
+    with pytest.raises(HTTPException) as error:
+        projection(fields)
+
+    assert error.value.status_code == 400
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from datetime import datetime
+
+from core.database import schedule
+
+
+def at(time_string):
+    return datetime.strptime(f"2020-12-15 {time_string}", "%Y-%m-%d %H:%M")
+
+
+def lesson(name, start, end, room=1):
+    return {
+        "id": name,
+        "name": name,
+        "ruz_auditorium_oid": room,
+        "start": at(start),
+        "end": at(end),
+    }
+
+
+def load(monkeypatch, *lessons, window_start=datetime.min):
+    monkeypatch.setattr(schedule, "schedules", {})
+    monkeypatch.setattr(schedule, "placed", {})
+    monkeypatch.setattr(schedule, "expires_at", time.monotonic() + 60)
+    monkeypatch.setattr(schedule, "window_start", window_start)
+
+    for item in lessons:
+        schedule.apply(item["id"], item)
+
+
+def name(found):
+    return found["name"] if found else None
+
+
+def current(time_string):
+    return name(asyncio.run(schedule.current_lesson(1, at(time_string))))
+
+
+def following(time_string):
+    return name(asyncio.run(schedule.next_lesson(1, at(time_string))))
+
+
+LESSONS = [
+    lesson("first", "09:30", "10:50"),
+    lesson("second", "11:10", "12:30"),
+    lesson("third", "12:30", "13:50"),
+]
+
+
+def test_current_lesson_bounds(monkeypatch):
+    load(monkeypatch, *LESSONS)
+
+    assert current("09:29") is None
+    assert current("09:30") == "first"
+    assert current("10:49") == "first"
+    assert current("10:50") is None
+    # One lesson ends as the next one starts
+    assert current("12:30") == "third"
+    assert current("13:50") is None
+
+
+def test_current_lesson_under_a_longer_one(monkeypatch):
+    load(monkeypatch, lesson("day", "09:00", "18:00"), *LESSONS)
+
+    assert current("11:00") == "day"
+    assert current("11:10") == "second"
+    assert current("17:00") == "day"
+
+
+def test_next_lesson_bounds(monkeypatch):
+    load(monkeypatch, *LESSONS)
+
+    assert following("09:00") == "first"
+    # Lessons that start at the time are current, not next
+    assert following("09:30") == "second"
+    assert following("12:29") == "third"
+    assert following("12:30") is None
+
+
+def test_unknown_room(monkeypatch):
+    load(monkeypatch, *LESSONS)
+
+    assert asyncio.run(schedule.current_lesson(2, at("10:00"))) is None
+    assert asyncio.run(schedule.next_lesson(2, at("10:00"))) is None
+
+
+def test_times_before_the_schedule_are_looked_up_in_mongo(monkeypatch):
+    # Lessons held at 12:30 or later are all loaded
+    load(monkeypatch, *LESSONS, window_start=at("00:30"))
+    queries = []
+
+    class Lessons:
+        async def find_one(self, query, sort):
+            queries.append(query)
+            return {"name": "stored"}
+
+    monkeypatch.setattr(schedule, "lessons_collection", Lessons())
+
+    assert current("10:00") == "stored"
+    assert current("12:30") == "third"
+    assert following("00:00") == "stored"
+    assert following("10:00") == "second"
+    assert len(queries) == 2
+
+
+def test_writes_are_put_in_place(monkeypatch):
+    load(monkeypatch, *LESSONS)
+
+    # Moved to another time and room
+    schedule.apply("second", lesson("second", "14:00", "15:20", room=2))
+    assert current("11:30") is None
+    assert following("12:29") == "third"
+    assert asyncio.run(schedule.next_lesson(2, at("12:00")))["name"] == "second"
+
+    schedule.apply("third", None)
+    assert current("13:00") is None
+    assert following("09:30") is None
+
+    document = lesson("fourth", "16:00", "17:20")
+    document["_id"] = document.pop("id")
+    schedule.on_change({"documentKey": {"_id": "fourth"}, "fullDocument": document})
+    assert following("09:30") == "fourth"
+    assert schedule.placed["fourth"] == (1, at("16:00"))
+    assert schedule.is_fresh()
+
+    # The change stream started over
+    schedule.on_change(None)
+    assert not schedule.is_fresh()
+
+
+def test_writes_made_while_loading_are_kept(monkeypatch):
+    load(monkeypatch)
+
+    class Cursor:
+        def sort(self, key, direction):
+            return self
+
+        async def __aiter__(self):
+            yield lesson("first", "09:30", "10:50")
+            # Written after the cursor read it
+            schedule.apply("first", None)
+            schedule.apply("second", lesson("second", "11:10", "12:30"))
+
+    class Lessons:
+        def find(self, query):
+            return Cursor()
+
+    monkeypatch.setattr(schedule, "lessons_collection", Lessons())
+    monkeypatch.setattr(schedule, "local_time", lambda: at("00:00"))
+    asyncio.run(schedule.load())
+
+    assert current("10:00") is None
+    assert current("11:30") == "second"
+    assert schedule.placed == {"second": (1, at("11:10"))}
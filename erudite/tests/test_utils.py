@@ -0,0 +1,110 @@
+import asyncio
+import json
+from datetime import datetime
+
+import bson
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from core.database import utils
+from core.database.utils import (
+    decode_cursor,
+    encode_cursor,
+    find_by_ids,
+    json_chunks,
+    local_time,
+    with_datetimes,
+)
+
+
+def times(start_time, end_time):
+    document = with_datetimes(
+        {"date": "2020-12-15", "start_time": start_time, "end_time": end_time}
+    )
+    return document["start"], document["end"]
+
+
+def test_with_datetimes():
+    assert times("09:30", "10:50") == (datetime(2020, 12, 15, 9, 30), datetime(2020, 12, 15, 10, 50))
+    assert times("09:30:00", "10:50:00") == times("09:30", "10:50")
+
+
+def test_with_datetimes_crossing_midnight():
+    assert times("23:00", "01:00") == (datetime(2020, 12, 15, 23), datetime(2020, 12, 16, 1))
+
+
+def test_with_datetimes_of_an_empty_interval():
+    assert times("13:00", "13:00") == (datetime(2020, 12, 15, 13), datetime(2020, 12, 15, 13))
+
+
+def test_with_datetimes_unreadable():
+    assert times("25:00", "10:50") == (None, datetime(2020, 12, 15, 10, 50))
+    assert with_datetimes({})["start"] is None
+
+
+def test_local_time(monkeypatch):
+    monkeypatch.setattr(utils, "timezone", utils.ZoneInfo("Europe/Moscow"))
+
+    naive = datetime(2020, 12, 15, 10)
+    aware = datetime.fromisoformat("2020-12-15T07:00:00+00:00")
+
+    assert local_time(naive) == naive
+    assert local_time(aware) == naive
+    assert local_time().tzinfo is None
+
+
+def test_json_chunks_write_iso_datetimes():
+    async def documents():
+        yield {"id": ObjectId("5fd8e2a5c6a4d3b2a1f0e9d8"), "start": datetime(2020, 12, 15, 9, 30)}
+        yield {"name": "Ауд. 504"}
+
+    async def collect():
+        return b"".join([chunk async for chunk in json_chunks(documents(), "[", ",", "]", 8)])
+
+    assert json.loads(asyncio.run(collect())) == [
+        {"id": "5fd8e2a5c6a4d3b2a1f0e9d8", "start": "2020-12-15T09:30:00"},
+        {"name": "Ауд. 504"},
+    ]
+
+
+def test_cursor_round_trip():
+    values = {"date": "2020-12-15", "id": "5fd8e2a5c6a4d3b2a1f0e9d8"}
+
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+def test_broken_cursors_are_none():
+    assert decode_cursor("not a cursor") is None
+    assert decode_cursor(encode_cursor([1, 2])) is None
+    assert decode_cursor("") is None
+
+
+class Found:
+    """ Returns the stored documents with the asked ids in the order they are stored """
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def find(self, query, projection=None):
+        for document in self.documents:
+            _id = document["_id"] if isinstance(document, RawBSONDocument) else document["id"]
+            if ObjectId(str(_id)) in query["_id"]["$in"]:
+                yield document
+
+
+def test_find_by_ids_keeps_the_order_of_ids():
+    a, b, c, missing = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    collection = Found([{"id": str(_id)} for _id in (a, b, c)])
+
+    found = asyncio.run(find_by_ids(collection, [c, missing, a, c]))
+
+    assert found == [{"id": str(c)}, {"id": str(a)}]
+
+
+def test_find_by_ids_of_raw_documents():
+    a, b = ObjectId(), ObjectId()
+    collection = Found([RawBSONDocument(bson.encode({"_id": _id})) for _id in (a, b)])
+
+    found = asyncio.run(find_by_ids(collection, [b, a]))
+
+    assert [document["_id"] for document in found] == [b, a]